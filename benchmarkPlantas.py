@@ -0,0 +1,408 @@
+"""Headless performance benchmarks for the plant diagnosis and recommendation system
+
+Runs without a display (matplotlib uses the Agg backend) and writes the
+results as JSON, so runs can be compared to detect regressions:
+
+    python benchmarkPlantas.py -o base.json
+    python benchmarkPlantas.py -o nuevo.json --compare base.json --threshold 0.2
+
+The comparison looks at the median of each benchmark and exits with status 1
+when any of them got slower than the threshold allows.
+"""
+import argparse
+import copy
+import json
+import platform
+import statistics
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+import historialPlantas as historial
+import informePlantas as informe
+import nucleoPlantas as nucleo
+import sensoresPlantas as sensores
+import sitioPlantas as sitio
+
+# Registered benchmarks, in execution order: name -> function(repeat) -> samples in seconds
+BENCHMARKS: Dict[str, Callable[[int], List[float]]] = {}
+
+# Input grid for the fuzzy benchmarks (pH step 1, riego step 1)
+PH_GRID = [float(ph) for ph in range(0, 15)]
+RIEGO_GRID = [float(riego) for riego in range(0, 11)]
+
+# Plots fed to the sensor stream and site ranking benchmarks
+STREAM_PLOTS = 100000
+
+# Diagnoses and recommendations per history_write transaction
+HISTORY_BATCH = 10000
+
+# Cold-start benchmarks run in a fresh interpreter
+STARTUP_SCRIPTS = {
+    'startup_diagnosis': (
+        "import nucleoPlantas as nucleo; "
+        "nucleo.DiagnosisEngine().diagnose({'Color de hojas': 'verde pálido'})"
+    ),
+    'startup_recommendation': (
+        "import nucleoPlantas as nucleo; "
+        "nucleo.RecommendationEngine().recommend(6.5, 4.0)"
+    ),
+}
+
+
+def benchmark(name: str):
+    """Register a benchmark function under a name"""
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _timeit(function: Callable, repeat: int) -> List[float]:
+    """Run a function repeat times and return each duration"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _grid():
+    """Every (pH, riego) pair of the benchmark grid"""
+    return [(ph, riego) for ph in PH_GRID for riego in RIEGO_GRID]
+
+
+@benchmark('create_expert_system')
+def bench_create_expert_system(repeat: int) -> List[float]:
+    return _timeit(nucleo.create_expert_system, repeat)
+
+
+@benchmark('expert_system_snapshot')
+def bench_create_expert_system_snapshot(repeat: int) -> List[float]:
+    """Loading the rule base from its binary snapshot (written on the first call)"""
+    nucleo.create_expert_system(snapshot=True)
+    return _timeit(lambda: nucleo.create_expert_system(snapshot=True), repeat)
+
+
+@benchmark('diagnosis')
+def bench_diagnosis(repeat: int) -> List[float]:
+    """One run_diagnosis-equivalent per symptom combination"""
+    engine = nucleo.DiagnosisEngine()
+    combinations = nucleo.all_symptom_sets()
+    samples = []
+    for _ in range(repeat):
+        for symptoms in combinations:
+            start = time.perf_counter()
+            engine.diagnose(symptoms)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+@benchmark('create_fuzzy_system')
+def bench_create_fuzzy_system(repeat: int) -> List[float]:
+    # Import skfuzzy first so only the construction is timed
+    nucleo.create_fuzzy_system()
+    return _timeit(nucleo.create_fuzzy_system, repeat)
+
+
+@benchmark('fuzzy_compute')
+def bench_fuzzy_compute(repeat: int) -> List[float]:
+    """sistema.compute() per point of the pH/riego grid, without skfuzzy's cache"""
+    fuzzy_system = nucleo.create_fuzzy_system()
+    sistema = nucleo.ctrl.ControlSystemSimulation(fuzzy_system.control, cache=False)
+    samples = []
+    for _ in range(repeat):
+        for ph, riego in _grid():
+            start = time.perf_counter()
+            sistema.input['acidez'] = ph
+            sistema.input['riego'] = riego
+            sistema.compute()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+@benchmark('update_graph')
+def bench_update_graph(repeat: int) -> List[float]:
+    """Updating and rendering the recommendation plot, as update_graph does, on Agg"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fuzzy_system = nucleo.create_fuzzy_system()
+    plot = nucleo.RecommendationPlot(fuzzy_system.planta)
+    canvas = FigureCanvasAgg(plot.figure)
+    model = nucleo.shared_fuzzy_model()
+    results = [nucleo.evaluate_recommendation(ph, riego, model) for ph, riego in _grid()]
+    canvas.draw()
+    samples = []
+    for _ in range(repeat):
+        for resultado, cuts in results:
+            start = time.perf_counter()
+            plot.update(resultado, cuts)
+            canvas.draw()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+@benchmark('report_chart')
+def bench_report_chart(repeat: int) -> List[float]:
+    """Writing one per-sample PNG report chart with the reused, blitted ReportRenderer figure"""
+    renderer = informe.ReportRenderer()
+    samples = []
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(repeat):
+            for index, (ph, riego) in enumerate(_grid()):
+                start = time.perf_counter()
+                renderer.render_sample(directory, index, ph, riego)
+                samples.append(time.perf_counter() - start)
+    renderer.close()
+    return samples
+
+
+@benchmark('stream_update')
+def bench_stream_update(repeat: int) -> List[float]:
+    """One SensorStream batch of slightly drifting readings from STREAM_PLOTS plots"""
+    rng = np.random.default_rng(0)
+    plots = [f'parcela-{i}' for i in range(STREAM_PLOTS)]
+    ph_values = rng.uniform(0, 14, STREAM_PLOTS)
+    riego_values = rng.uniform(0, 10, STREAM_PLOTS)
+    stream = sensores.SensorStream()
+    stream.update(plots, ph_values, riego_values)
+    samples = []
+    for _ in range(repeat):
+        ph_values = (ph_values + rng.normal(0, 0.01, STREAM_PLOTS)).clip(0, 14)
+        riego_values = (riego_values + rng.normal(0, 0.01, STREAM_PLOTS)).clip(0, 10)
+        start = time.perf_counter()
+        stream.update(plots, ph_values, riego_values)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+@benchmark('site_ranking')
+def bench_site_ranking(repeat: int) -> List[float]:
+    """Memberships, top-3 plants and statistics of a site of STREAM_PLOTS plots"""
+    rng = np.random.default_rng(0)
+    ph_values = rng.uniform(0, 14, STREAM_PLOTS)
+    riego_values = rng.uniform(0, 10, STREAM_PLOTS)
+    planner = sitio.SitePlanner()
+    
+    def rank():
+        values, memberships = planner.evaluate(ph_values, riego_values)
+        sitio.SiteStatistics(planner.plants).add(values, memberships)
+        planner.top(memberships, 3)
+    return _timeit(rank, repeat)
+
+
+@benchmark('history_write')
+def bench_history_write(repeat: int) -> List[float]:
+    """Writing HISTORY_BATCH diagnoses and recommendations in one transaction"""
+    engine = nucleo.DiagnosisEngine()
+    results = [engine.diagnose(symptoms) for symptoms in nucleo.all_symptom_sets()]
+    results = (results * (HISTORY_BATCH // len(results) + 1))[:HISTORY_BATCH]
+    recommendations = [nucleo.Recommendation(ph, riego, 2.0, 'Rosal') for ph, riego in _grid()]
+    recommendations = (recommendations * (HISTORY_BATCH // len(recommendations) + 1))[:HISTORY_BATCH]
+    with tempfile.TemporaryDirectory() as directory:
+        store = historial.HistoryStore(os.path.join(directory, 'historial.db'), batch_size=4 * HISTORY_BATCH)
+        samples = []
+        for _ in range(repeat):
+            store.record_diagnoses(results)
+            store.record_recommendations(recommendations)
+            start = time.perf_counter()
+            store.flush()
+            samples.append(time.perf_counter() - start)
+        store.close()
+    return samples
+
+
+def _startup(script: str, repeat: int) -> List[float]:
+    """Wall time of a fresh interpreter importing the module and getting a first result"""
+    directory = os.path.dirname(os.path.abspath(nucleo.__file__))
+    return _timeit(lambda: subprocess.run([sys.executable, '-c', script], check=True, cwd=directory), repeat)
+
+
+@benchmark('startup_diagnosis')
+def bench_startup_diagnosis(repeat: int) -> List[float]:
+    return _startup(STARTUP_SCRIPTS['startup_diagnosis'], repeat)
+
+
+@benchmark('startup_recommendation')
+def bench_startup_recommendation(repeat: int) -> List[float]:
+    return _startup(STARTUP_SCRIPTS['startup_recommendation'], repeat)
+
+
+def _retained_bytes(factory: Callable, count: int) -> float:
+    """Python heap kept alive per object when count objects from factory exist at once"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [factory() for _ in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+
+def measure_request_memory(concurrency: int = 64) -> Dict[str, float]:
+    """Bytes of per-request fuzzy state for concurrency simultaneous recommendations
+
+    Compares a full copy of the skfuzzy model per request (what concurrent
+    callers need to avoid racing on a shared ControlSystemSimulation), a new
+    simulation over a shared control system, and a FuzzyEvaluation over the
+    shared read-only model. Each request has computed one output.
+    """
+    fuzzy_system = nucleo.create_fuzzy_system()
+    model = nucleo.shared_fuzzy_model()
+
+    def computed(simulation):
+        simulation.input['acidez'] = 6.5
+        simulation.input['riego'] = 4.0
+        simulation.compute()
+        return simulation
+
+    def full_copy():
+        control = copy.deepcopy(fuzzy_system.control)
+        return control, computed(nucleo.ctrl.ControlSystemSimulation(control, cache=False))
+
+    computed(nucleo.FuzzyEvaluation(model))
+    return {
+        'skfuzzy_full_copy': _retained_bytes(full_copy, concurrency),
+        'skfuzzy_simulation': _retained_bytes(
+            lambda: computed(nucleo.ctrl.ControlSystemSimulation(fuzzy_system.control, cache=False)), concurrency),
+        'fuzzy_evaluation': _retained_bytes(lambda: computed(nucleo.FuzzyEvaluation(model)), concurrency),
+    }
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summary statistics of a list of durations, in seconds"""
+    ordered = sorted(samples)
+    return {
+        'n': len(samples),
+        'mean': statistics.fmean(samples),
+        'median': statistics.median(samples),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0
+    }
+
+
+def _versions() -> Dict[str, str]:
+    """Versions of the libraries that affect the results"""
+    versions = {'python': platform.python_version()}
+    for name in ('clips', 'numpy', 'skfuzzy', 'matplotlib'):
+        try:
+            module = __import__(name)
+            versions[name] = getattr(module, '__version__', 'unknown')
+        except ImportError:
+            versions[name] = None
+    return versions
+
+
+def run_benchmarks(names: List[str] = None, repeat: int = 5) -> Dict:
+    """Run the selected benchmarks (all by default) and return the results document"""
+    results = {}
+    for name, function in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        print(f"Ejecutando {name}...", file=sys.stderr)
+        results[name] = summarize(function(repeat))
+    return {
+        'metadata': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'platform': platform.platform(),
+            'versions': _versions(),
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.1) -> List[Dict]:
+    """Median change of every benchmark present in both runs
+
+    A benchmark is a regression when its median grew by more than threshold
+    (0.1 = 10%).
+    """
+    rows = []
+    for name, stats in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        change = stats['median'] / base['median'] - 1 if base['median'] else 0.0
+        rows.append({
+            'name': name,
+            'baseline': base['median'],
+            'current': stats['median'],
+            'change': change,
+            'regression': change > threshold
+        })
+    return rows
+
+
+def print_results(document: Dict):
+    """Print a human-readable table of the results"""
+    print(f"{'benchmark':<24} {'n':>6} {'median ms':>11} {'p95 ms':>10} {'max ms':>10}")
+    for name, stats in document['results'].items():
+        print(f"{name:<24} {stats['n']:>6} {stats['median'] * 1000:>11.3f} "
+              f"{stats['p95'] * 1000:>10.3f} {stats['max'] * 1000:>10.3f}")
+
+
+def print_comparison(rows: List[Dict], threshold: float):
+    """Print the comparison against a baseline, flagging regressions"""
+    print(f"\nComparación (umbral {threshold:+.0%}):")
+    for row in rows:
+        flag = "REGRESIÓN" if row['regression'] else ""
+        print(f"{row['name']:<24} {row['baseline'] * 1000:>11.3f} -> {row['current'] * 1000:>11.3f} ms "
+              f"{row['change']:>+8.1%} {flag}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks del sistema de plantas")
+    parser.add_argument('-o', '--output', help="archivo JSON donde guardar los resultados")
+    parser.add_argument('--repeat', type=int, default=5, help="repeticiones por benchmark")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="benchmarks a ejecutar")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON de referencia con el que comparar")
+    parser.add_argument('--results', metavar='FILE', help="comparar este JSON en lugar de ejecutar")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="aumento relativo de la mediana considerado regresión (0.1 = 10%%)")
+    parser.add_argument('--memory', type=int, metavar='N',
+                        help="medir la memoria por solicitud con N recomendaciones simultáneas")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        with open(args.results, encoding='utf-8') as f:
+            document = json.load(f)
+    else:
+        document = run_benchmarks(args.only, args.repeat)
+    print_results(document)
+
+    if args.memory:
+        document['memory'] = measure_request_memory(args.memory)
+        print(f"\nMemoria por solicitud ({args.memory} simultáneas):")
+        for name, size in document['memory'].items():
+            print(f"{name:<24} {size / 1024:>11.1f} KiB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(document, baseline, args.threshold)
+        print_comparison(rows, args.threshold)
+        if any(row['regression'] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
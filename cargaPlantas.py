@@ -0,0 +1,161 @@
+"""Load test for the local HTTP service (servidorPlantas.py)
+
+Opens a number of keep-alive connections against localhost, sends field
+records as fast as the server answers them and reports throughput and
+latency percentiles:
+
+    python servidorPlantas.py --port 8080 &
+    python cargaPlantas.py --port 8080 --requests 20000 --concurrency 64
+
+With --start-server the script launches the server itself on a free port and
+stops it (SIGTERM, so through the graceful shutdown) when done.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import nucleoPlantas as nucleo
+
+
+def _records(count: int, seed: int = 0) -> List[Dict]:
+    """Field records mixing every symptom combination with random pH/riego values"""
+    rng = random.Random(seed)
+    combinations = nucleo.all_symptom_sets()
+    records = []
+    for index in range(count):
+        record = {category: symptom for category, symptom in combinations[index % len(combinations)].items() if symptom}
+        record[nucleo.RECORD_PH] = round(rng.uniform(0, 14), 2)
+        record[nucleo.RECORD_RIEGO] = round(rng.uniform(0, 10), 2)
+        records.append(record)
+    return records
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def _client(host: str, port: int, path: str, bodies: List[bytes], latencies: List[float], statuses: Dict[int, int]):
+    """One keep-alive connection sending its share of the requests one after another"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            request = (f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                       f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body
+            start = time.perf_counter()
+            writer.write(request)
+            try:
+                line = await reader.readline()
+            except ConnectionError:
+                line = b''
+            if not line:
+                # Closed by the server (shutting down): the remaining requests are not sent
+                statuses[0] = statuses.get(0, 0) + 1
+                break
+            status = int(line.split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load(host: str, port: int, path: str = '/evaluar', requests: int = 10000,
+                   concurrency: int = 32) -> Dict:
+    """Send the requests over concurrency connections and summarize the answers"""
+    bodies = [json.dumps(record, ensure_ascii=False).encode('utf-8') for record in _records(requests)]
+    shares = [bodies[index::concurrency] for index in range(concurrency)]
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, path, share, latencies, statuses) for share in shares if share))
+    elapsed = time.perf_counter() - start
+    ordered = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50': percentile(ordered, 0.50),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1],
+        'statuses': {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(host: str, port: int, process: subprocess.Popen, timeout: float = 60.0):
+    """Block until the server accepts connections"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("El servidor terminó antes de aceptar conexiones")
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("El servidor no respondió a tiempo")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor de plantas")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--path', choices=('/evaluar', '/diagnostico', '/recomendacion'), default='/evaluar')
+    parser.add_argument('--requests', type=int, default=10000, help="solicitudes en total")
+    parser.add_argument('--concurrency', type=int, default=32, help="conexiones simultáneas")
+    parser.add_argument('--start-server', action='store_true',
+                        help="lanzar servidorPlantas.py en un puerto libre y detenerlo al terminar")
+    parser.add_argument('--server-args', default='', help="opciones extra para el servidor lanzado")
+    parser.add_argument('-o', '--output', help="archivo JSON donde guardar el resumen")
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.start_server:
+        args.port = _free_port()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'servidorPlantas.py')
+        command = [sys.executable, script, '--host', args.host, '--port', str(args.port)]
+        process = subprocess.Popen(command + args.server_args.split())
+        _wait_for_server(args.host, args.port, process)
+    try:
+        summary = asyncio.run(run_load(args.host, args.port, args.path, args.requests, args.concurrency))
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+
+    print(f"{summary['requests']} solicitudes en {summary['seconds']:.2f} s "
+          f"({summary['requests_per_second']:.0f} req/s, {summary['concurrency']} conexiones)")
+    print(f"p50 {summary['p50'] * 1000:.2f} ms  p99 {summary['p99'] * 1000:.2f} ms  "
+          f"máx {summary['max'] * 1000:.2f} ms")
+    print(f"Estados: {summary['statuses']}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if set(summary['statuses']) == {'200'} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
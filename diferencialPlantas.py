@@ -0,0 +1,114 @@
+"""Ranked differential diagnosis from weighted symptom evidence
+
+Rather than only the deficiencies whose rules fire, DifferentialDiagnosis
+ranks every deficiency of the knowledge base by the share of its symptom
+evidence observed in a report; the GUI shows it and the headless pipeline
+adds it with --top-k:
+
+    python sistemaPlantas.py --headless registros.csv --top-k 3
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, Iterable, List, NamedTuple
+
+import nucleoPlantas as nucleo
+
+np = nucleo.LazyModule('numpy', 'np', globals())
+
+
+class RankedDiagnosis(NamedTuple):
+    """One entry of a differential diagnosis, with its supporting evidence"""
+    deficiency: str
+    confidence: float
+    treatment: str
+
+
+class DifferentialDiagnosis:
+    """Ranked differential diagnosis from weighted symptom -> deficiency evidence
+    
+    The knowledge base becomes a (symptoms x deficiencies) NumPy matrix whose
+    entry is the weight of a symptom for a deficiency (1 unless the knowledge
+    base gives a third value, [categoria, caracteristica, peso]), normalized
+    so each column sums to 1. The confidence of a deficiency is then the share
+    of its evidence that was observed, from 0 to 1, and a batch of reports is
+    scored with one sparse product of its report matrix by the weights, over
+    the nonzero weights only, so the cost grows with the evidence touched by
+    the reports rather than with the size of the catalog. Deficiencies with some evidence are
+    ranked by confidence, ties in knowledge-base order; unknown symptoms are
+    ignored.
+    """
+    
+    def __init__(self, knowledge_base: Dict = None, chunk_size: int = 1024):
+        knowledge_base = knowledge_base if knowledge_base is not None else nucleo.KNOWLEDGE_BASE
+        self.chunk_size = chunk_size
+        self.symptoms = {}
+        for category, characteristics in knowledge_base['sintomas'].items():
+            for characteristic in characteristics:
+                self.symptoms.setdefault((category, characteristic), len(self.symptoms))
+        deficiencies = knowledge_base['deficiencias']
+        self.deficiencies = list(deficiencies)
+        self.treatments = [data['tratamiento'] for data in deficiencies.values()]
+        for data in deficiencies.values():
+            for category, characteristic, *_ in data['sintomas']:
+                self.symptoms.setdefault((category, characteristic), len(self.symptoms))
+        
+        weights = np.zeros((len(self.symptoms), len(self.deficiencies)), dtype=np.float32)
+        for column, data in enumerate(deficiencies.values()):
+            for category, characteristic, *weight in data['sintomas']:
+                weights[self.symptoms[(category, characteristic)], column] += weight[0] if weight else 1.0
+        totals = weights.sum(axis=0)
+        self.weights = weights / np.where(totals > 0, totals, 1)
+        self.weights.setflags(write=False)
+        
+        # Nonzero weights by symptom (CSR layout), for batch scoring
+        symptom_rows, self._entry_deficiency = np.nonzero(self.weights)
+        self._entry_weight = self.weights[symptom_rows, self._entry_deficiency]
+        self._entry_start = np.concatenate(([0], np.cumsum(np.bincount(symptom_rows, minlength=len(self.symptoms)))))
+    
+    def columns(self, symptoms: nucleo.SymptomSet) -> List[int]:
+        """Matrix rows of the known symptoms of a report"""
+        return [self.symptoms[pair] for pair in set(nucleo.normalize_symptoms(symptoms)) if pair in self.symptoms]
+    
+    def scores(self, symptom_sets: List[nucleo.SymptomSet]) -> np.ndarray:
+        """Confidence of every deficiency for every report, shape (reports, deficiencies)"""
+        deficiencies = len(self.deficiencies)
+        out = np.empty((len(symptom_sets), deficiencies), dtype=np.float32)
+        for start in range(0, len(symptom_sets), self.chunk_size):
+            columns = [self.columns(symptoms) for symptoms in symptom_sets[start:start + self.chunk_size]]
+            reports = np.repeat(np.arange(len(columns)), [len(report) for report in columns])
+            rows = np.array([row for report in columns for row in report], dtype=np.intp)
+            
+            # Sparse product: every nonzero weight of every observed symptom, summed per (report, deficiency)
+            counts = self._entry_start[rows + 1] - self._entry_start[rows]
+            first = np.cumsum(counts) - counts
+            entries = np.arange(counts.sum()) - np.repeat(first - self._entry_start[rows], counts)
+            keys = np.repeat(reports, counts) * deficiencies + self._entry_deficiency[entries]
+            out[start:start + len(columns)] = np.bincount(
+                keys, weights=self._entry_weight[entries], minlength=len(columns) * deficiencies
+            ).reshape(len(columns), deficiencies)
+        return out
+    
+    def _top(self, scores: np.ndarray, k: int) -> List[RankedDiagnosis]:
+        """Ranked entries of one row of scores"""
+        candidates = np.flatnonzero(scores > 0)
+        # By confidence, then knowledge-base order
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return [RankedDiagnosis(self.deficiencies[column], round(float(scores[column]), 6), self.treatments[column])
+                for column in candidates]
+    
+    def rank(self, symptoms: nucleo.SymptomSet, k: int = 3) -> List[RankedDiagnosis]:
+        """Top-k deficiencies of one report by confidence"""
+        start = time.perf_counter()
+        scores = self.weights[self.columns(symptoms)].sum(axis=0)
+        ranking = self._top(scores, k)
+        nucleo.METRICS.observe('diagnosis_ranked', time.perf_counter() - start)
+        return ranking
+    
+    def rank_many(self, symptom_sets: Iterable[nucleo.SymptomSet], k: int = 3) -> List[List[RankedDiagnosis]]:
+        """Top-k deficiencies of every report, scored as a batch"""
+        symptom_sets = list(symptom_sets)
+        start = time.perf_counter()
+        rankings = [self._top(row, k) for row in self.scores(symptom_sets)]
+        nucleo.METRICS.observe('diagnosis_ranked_batch', time.perf_counter() - start)
+        return rankings
@@ -0,0 +1,231 @@
+"""Synthetic knowledge bases and a scalability harness for the expert system
+
+Generates symptom catalogs and deficiency/disease/pest rule sets of any size
+in the format of baseConocimiento.json (so the rules have the same shape as
+the real sintoma/diagnostico/tratamiento ones) and measures, for each size,
+how long the CLIPS rule base takes to build, how much memory it uses and how
+long a diagnosis takes:
+
+    python escalaPlantas.py --deficiencies 10 100 1000 --symptoms 100 1000 5000 --fan-in 4
+    python escalaPlantas.py --deficiencies 50 --symptoms 2000 --write-kb grande.json
+
+Every (deficiencies, symptoms) pair is measured in a fresh process, so the
+memory figures of one size do not leak into the next.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+from itertools import product
+from queue import Empty
+from typing import Dict, List
+
+import diferencialPlantas as diferencial
+import mascarasPlantas as mascaras
+import nucleoPlantas as nucleo
+
+# Kinds of problems in a synthetic knowledge base, used in turn
+PROBLEM_KINDS = ('deficiencia', 'enfermedad', 'plaga')
+
+
+def synthetic_knowledge_base(deficiencies: int, symptoms: int, fan_in: int = 2, categories: int = 8,
+                             seed: int = 0) -> Dict:
+    """Knowledge base with deficiencies problems, symptoms symptoms and fan_in symptoms per problem
+
+    Symptoms are spread evenly over categories; each problem is diagnosed by
+    any of fan_in randomly chosen symptoms (an OR, like the real rules) and
+    has its own treatment.
+    """
+    if fan_in > symptoms:
+        raise ValueError("fan_in no puede superar el número de síntomas.")
+    rng = random.Random(seed)
+    catalog = {f"Categoría {category + 1}": [] for category in range(categories)}
+    names = list(catalog)
+    pairs = []
+    for symptom in range(symptoms):
+        category = names[symptom % categories]
+        characteristic = f"síntoma {symptom + 1}"
+        catalog[category].append(characteristic)
+        pairs.append([category, characteristic])
+
+    problems = {}
+    for index in range(deficiencies):
+        name = f"{PROBLEM_KINDS[index % len(PROBLEM_KINDS)]}-{index + 1}"
+        problems[name] = {
+            'sintomas': rng.sample(pairs, fan_in),
+            'tratamiento': f"Tratamiento para {name}"
+        }
+    return {'sintomas': catalog, 'deficiencias': problems}
+
+
+def symptom_reports(knowledge_base: Dict, count: int, size: int = 3, seed: int = 1) -> List[List[List[str]]]:
+    """Random field reports of size observed symptoms each, drawn from the catalog"""
+    rng = random.Random(seed)
+    pairs = [[category, symptom] for category, symptoms in knowledge_base['sintomas'].items() for symptom in symptoms]
+    return [rng.sample(pairs, min(size, len(pairs))) for _ in range(count)]
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(deficiencies: int, symptoms: int, fan_in: int = 2, categories: int = 8, samples: int = 200,
+            report_size: int = 3, bitmask: bool = True) -> Dict:
+    """Build, memory and diagnosis figures of one synthetic knowledge base size"""
+    knowledge_base = synthetic_knowledge_base(deficiencies, symptoms, fan_in, categories)
+    reports = symptom_reports(knowledge_base, samples, report_size)
+    row = {'deficiencies': deficiencies, 'symptoms': symptoms, 'fan_in': fan_in}
+
+    start = time.perf_counter()
+    constructs = nucleo.expert_system_constructs(knowledge_base)
+    row['generate_seconds'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    env = nucleo.create_expert_system(knowledge_base)
+    row['build_seconds'] = time.perf_counter() - start
+    row['constructs'] = len(constructs)
+    row['clips_memory_bytes'] = int(env.eval('(mem-used)'))
+
+    engine = nucleo.DiagnosisEngine(env)
+    latencies = []
+    expected = []
+    for report in reports:
+        start = time.perf_counter()
+        result = engine.diagnose(report)
+        latencies.append(time.perf_counter() - start)
+        expected.append(result)
+    ordered = sorted(latencies)
+    row['diagnosis_p50'] = _percentile(ordered, 0.5)
+    row['diagnosis_p99'] = _percentile(ordered, 0.99)
+    row['deficiencies_per_report'] = sum(len(result.deficiencies) for result in expected) / len(reports)
+
+    if bitmask:
+        start = time.perf_counter()
+        compiled = mascaras.BitmaskDiagnosisEngine(env)
+        row['bitmask_compile_seconds'] = time.perf_counter() - start
+        latencies = []
+        mismatches = 0
+        for report, result in zip(reports, expected):
+            start = time.perf_counter()
+            compiled_result = compiled.diagnose(report)
+            latencies.append(time.perf_counter() - start)
+            mismatches += (set(compiled_result.deficiencies) != set(result.deficiencies)
+                           or set(compiled_result.treatments) != set(result.treatments))
+        ordered = sorted(latencies)
+        row['bitmask_p50'] = _percentile(ordered, 0.5)
+        row['bitmask_p99'] = _percentile(ordered, 0.99)
+        row['bitmask_mismatches'] = mismatches
+
+    # Ranked differential diagnosis: one report at a time and the whole sample as a batch
+    start = time.perf_counter()
+    ranking = diferencial.DifferentialDiagnosis(knowledge_base)
+    row['ranking_build_seconds'] = time.perf_counter() - start
+    latencies = []
+    for report in reports:
+        start = time.perf_counter()
+        ranking.rank(report)
+        latencies.append(time.perf_counter() - start)
+    row['ranking_p50'] = _percentile(sorted(latencies), 0.5)
+    start = time.perf_counter()
+    ranking.rank_many(reports)
+    row['ranking_batch_per_report'] = (time.perf_counter() - start) / len(reports)
+    return row
+
+
+def _measure_in_child(queue, arguments):
+    queue.put(measure(*arguments))
+
+
+def run_harness(deficiency_counts: List[int], symptom_counts: List[int], fan_in: int = 2, categories: int = 8,
+                samples: int = 200, report_size: int = 3, bitmask: bool = True, timeout: float = None) -> List[Dict]:
+    """Measure every (deficiencies, symptoms) combination, each in a fresh process
+    
+    A size whose process dies (an exception, running out of memory) or takes
+    longer than timeout seconds gets a row with an error instead of figures.
+    """
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for deficiencies, symptoms in product(deficiency_counts, symptom_counts):
+        if fan_in > symptoms:
+            continue
+        print(f"Midiendo {deficiencies} problemas x {symptoms} síntomas...", file=sys.stderr)
+        queue = context.Queue()
+        process = context.Process(target=_measure_in_child, args=(
+            queue, (deficiencies, symptoms, fan_in, categories, samples, report_size, bitmask)))
+        process.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        row = None
+        while row is None:
+            try:
+                row = queue.get(timeout=1.0)
+            except Empty:
+                if not process.is_alive():
+                    row = {'error': f"el proceso terminó con código {process.exitcode}"}
+                elif deadline is not None and time.monotonic() > deadline:
+                    process.kill()
+                    row = {'error': f"sin resultado tras {timeout:g} s"}
+        process.join()
+        if 'error' in row:
+            row.update(deficiencies=deficiencies, symptoms=symptoms, fan_in=fan_in)
+            print(f"Falló {deficiencies} problemas x {symptoms} síntomas: {row['error']}", file=sys.stderr)
+        rows.append(row)
+    return rows
+
+
+def print_rows(rows: List[Dict]):
+    """Print a human-readable table of the harness results"""
+    print(f"{'problemas':>9} {'síntomas':>9} {'build ms':>10} {'CLIPS MB':>9} "
+          f"{'diag p50 ms':>12} {'diag p99 ms':>12} {'bitmask p50 ms':>15} {'ranking p50 ms':>15}")
+    for row in rows:
+        if 'error' in row:
+            print(f"{row['deficiencies']:>9} {row['symptoms']:>9} error: {row['error']}")
+            continue
+        bitmask = f"{row['bitmask_p50'] * 1000:>15.3f}" if 'bitmask_p50' in row else f"{'-':>15}"
+        print(f"{row['deficiencies']:>9} {row['symptoms']:>9} {row['build_seconds'] * 1000:>10.1f} "
+              f"{row['clips_memory_bytes'] / 2 ** 20:>9.2f} {row['diagnosis_p50'] * 1000:>12.3f} "
+              f"{row['diagnosis_p99'] * 1000:>12.3f} {bitmask} {row['ranking_p50'] * 1000:>15.3f}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Escalabilidad del sistema experto con bases sintéticas")
+    parser.add_argument('--deficiencies', type=int, nargs='+', default=[3, 30, 300],
+                        help="número de deficiencias, enfermedades y plagas")
+    parser.add_argument('--symptoms', type=int, nargs='+', default=[12, 1000, 5000],
+                        help="tamaño del catálogo de síntomas")
+    parser.add_argument('--fan-in', type=int, default=2, help="síntomas que disparan cada regla")
+    parser.add_argument('--categories', type=int, default=8, help="categorías de síntomas")
+    parser.add_argument('--samples', type=int, default=200, help="diagnósticos medidos por tamaño")
+    parser.add_argument('--report-size', type=int, default=3, help="síntomas observados por diagnóstico")
+    parser.add_argument('--no-bitmask', action='store_true', help="no medir el motor de máscaras de bits")
+    parser.add_argument('--write-kb', metavar='FILE',
+                        help="solo escribir una base sintética (primer tamaño de cada lista) y terminar")
+    parser.add_argument('--timeout', type=float, help="segundos máximos por tamaño")
+    parser.add_argument('-o', '--output', help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args(argv)
+
+    if args.write_kb:
+        knowledge_base = synthetic_knowledge_base(args.deficiencies[0], args.symptoms[0], args.fan_in,
+                                                  args.categories)
+        with open(args.write_kb, 'w', encoding='utf-8') as f:
+            json.dump(knowledge_base, f, ensure_ascii=False, indent=2)
+        return 0
+
+    rows = run_harness(args.deficiencies, args.symptoms, args.fan_in, args.categories, args.samples,
+                       args.report_size, not args.no_bitmask, args.timeout)
+    print_rows(rows)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+    mismatches = sum(row.get('bitmask_mismatches', 0) for row in rows)
+    if mismatches:
+        print(f"{mismatches} diagnósticos difieren entre CLIPS y el motor de máscaras de bits", file=sys.stderr)
+        return 1
+    if any('error' in row for row in rows):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
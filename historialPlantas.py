@@ -0,0 +1,272 @@
+"""SQLite history of the expert system's diagnoses and recommendations
+
+The GUI saves every diagnosis and recommendation here; the headless pipeline
+does too when given --history:
+
+    python sistemaPlantas.py --headless muestras.csv --history historial.db
+
+and HistoryStore answers queries over any range of days, such as
+
+    HistoryStore('historial.db').deficiency_cases('potasio', since=time.time() - 30 * 86400)
+"""
+import atexit
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import nucleoPlantas as nucleo
+
+# Default history database (PLANTAS_HISTORY overrides it)
+HISTORY_PATH = os.environ.get('PLANTAS_HISTORY', os.path.join(
+    os.path.expanduser('~'), '.local', 'share', 'sistemaPlantas', 'historial.db'))
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagnosticos (
+    id INTEGER PRIMARY KEY,
+    fecha REAL NOT NULL,
+    sintomas TEXT NOT NULL,
+    deficiencias TEXT NOT NULL,
+    tratamientos TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS diagnosticos_fecha ON diagnosticos (fecha);
+CREATE TABLE IF NOT EXISTS deficiencias_diagnosticadas (
+    deficiencia TEXT NOT NULL,
+    fecha REAL NOT NULL,
+    diagnostico INTEGER NOT NULL REFERENCES diagnosticos (id),
+    PRIMARY KEY (deficiencia, fecha, diagnostico)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS recomendaciones (
+    id INTEGER PRIMARY KEY,
+    fecha REAL NOT NULL,
+    ph REAL NOT NULL,
+    riego REAL NOT NULL,
+    valor REAL NOT NULL,
+    planta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recomendaciones_fecha ON recomendaciones (fecha);
+CREATE TABLE IF NOT EXISTS resumen_deficiencias (
+    dia INTEGER NOT NULL,
+    deficiencia TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (dia, deficiencia)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS resumen_recomendaciones (
+    dia INTEGER NOT NULL,
+    banda INTEGER NOT NULL,
+    planta TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (dia, banda, planta)
+) WITHOUT ROWID;
+"""
+
+SECONDS_PER_DAY = 86400
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_diagnosis(result: nucleo.DiagnosisResult) -> Tuple[str, str, str]:
+    """JSON columns of a diagnosis; cached results repeat, so their encoding is reused"""
+    return (json.dumps(result.symptoms, ensure_ascii=False), json.dumps(result.deficiencies, ensure_ascii=False),
+            json.dumps(result.treatments, ensure_ascii=False))
+
+
+class HistoryStore:
+    """SQLite history of diagnoses and recommendations
+    
+    Records are buffered and written batch_size at a time in a single
+    transaction, on a database in WAL mode. There is no timer: a buffer whose
+    oldest record is flush_interval seconds old is only written when the next
+    record arrives, so callers that record rarely (like the GUI) should use a
+    small batch_size or call flush() themselves. Next to the raw rows, per-day summary tables
+    (deficiencies per day, plants per day and 1-unit pH band) are updated in
+    the same transaction, so counts and distributions over any range of days
+    read a few hundred rows whatever the size of the history; the case lists
+    use the (deficiencia, fecha) clustered index. Safe to share between
+    threads; close() (also run at exit) writes whatever is still buffered.
+    """
+    
+    def __init__(self, path: str = HISTORY_PATH, batch_size: int = 1000, flush_interval: float = 1.0):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(HISTORY_SCHEMA)
+        self._diagnoses = []
+        self._recommendations = []
+        self._oldest = None
+        atexit.register(self.close)
+    
+    def record_diagnosis(self, result: nucleo.DiagnosisResult, when: float = None):
+        """Queue one diagnosis for writing"""
+        self.record_diagnoses([result], when)
+    
+    def record_diagnoses(self, results: Iterable[nucleo.DiagnosisResult], when: float = None):
+        """Queue diagnoses for writing, all with the same timestamp (now by default)"""
+        when = time.time() if when is None else when
+        with self._lock:
+            self._diagnoses.extend((when, result) for result in results)
+            self._buffered()
+    
+    def record_recommendation(self, recommendation: nucleo.Recommendation, when: float = None):
+        """Queue one recommendation for writing"""
+        self.record_recommendations([recommendation], when)
+    
+    def record_recommendations(self, recommendations: Iterable[nucleo.Recommendation], when: float = None):
+        """Queue recommendations for writing, all with the same timestamp (now by default)"""
+        when = time.time() if when is None else when
+        with self._lock:
+            self._recommendations.extend((when, recommendation) for recommendation in recommendations)
+            self._buffered()
+    
+    def _buffered(self):
+        """Flush when the buffer is full or has waited long enough"""
+        now = time.monotonic()
+        if self._oldest is None:
+            self._oldest = now
+        if (len(self._diagnoses) + len(self._recommendations) >= self.batch_size
+                or now - self._oldest >= self.flush_interval):
+            self.flush()
+    
+    def flush(self):
+        """Write every buffered record in one transaction"""
+        with self._lock:
+            if not self._diagnoses and not self._recommendations:
+                return
+            start = time.perf_counter()
+            diagnoses, self._diagnoses = self._diagnoses, []
+            recommendations, self._recommendations = self._recommendations, []
+            self._oldest = None
+            connection = self._connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if diagnoses:
+                    self._write_diagnoses(diagnoses)
+                if recommendations:
+                    self._write_recommendations(recommendations)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            nucleo.METRICS.observe('history_flush', time.perf_counter() - start)
+            nucleo.METRICS.increment('history_rows', len(diagnoses) + len(recommendations))
+    
+    def _write_diagnoses(self, diagnoses: List[Tuple[float, nucleo.DiagnosisResult]]):
+        connection = self._connection
+        # Ids are assigned here so the deficiency rows can point at them; the
+        # IMMEDIATE transaction keeps other writers out meanwhile
+        first = connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM diagnosticos').fetchone()[0]
+        rows = []
+        cases = []
+        daily = {}
+        for offset, (when, result) in enumerate(diagnoses):
+            rows.append((first + offset, when, *_encode_diagnosis(result)))
+            day = int(when // SECONDS_PER_DAY)
+            for deficiency in result.deficiencies:
+                cases.append((deficiency, when, first + offset))
+                daily[day, deficiency] = daily.get((day, deficiency), 0) + 1
+        connection.executemany('INSERT INTO diagnosticos VALUES (?, ?, ?, ?, ?)', rows)
+        connection.executemany('INSERT INTO deficiencias_diagnosticadas VALUES (?, ?, ?)', cases)
+        connection.executemany(
+            'INSERT INTO resumen_deficiencias VALUES (?, ?, ?) '
+            'ON CONFLICT (dia, deficiencia) DO UPDATE SET total = total + excluded.total',
+            [(day, deficiency, total) for (day, deficiency), total in daily.items()])
+    
+    def _write_recommendations(self, recommendations: List[Tuple[float, nucleo.Recommendation]]):
+        connection = self._connection
+        rows = []
+        daily = {}
+        for when, recommendation in recommendations:
+            rows.append((when, recommendation.ph, recommendation.riego, recommendation.value, recommendation.plant))
+            key = (int(when // SECONDS_PER_DAY), int(recommendation.ph), recommendation.plant)
+            daily[key] = daily.get(key, 0) + 1
+        connection.executemany(
+            'INSERT INTO recomendaciones (fecha, ph, riego, valor, planta) VALUES (?, ?, ?, ?, ?)', rows)
+        connection.executemany(
+            'INSERT INTO resumen_recomendaciones VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (dia, banda, planta) DO UPDATE SET total = total + excluded.total',
+            [(day, band, plant, total) for (day, band, plant), total in daily.items()])
+    
+    def _query(self, sql: str, parameters=()) -> List[Tuple]:
+        with self._lock:
+            self.flush()
+            start = time.perf_counter()
+            rows = self._connection.execute(sql, parameters).fetchall()
+            nucleo.METRICS.observe('history_query', time.perf_counter() - start)
+            return rows
+    
+    @staticmethod
+    def _range(since: float = None, until: float = None) -> Tuple[float, float]:
+        return (float('-inf') if since is None else since, float('inf') if until is None else until)
+    
+    def deficiency_cases(self, deficiency: str, since: float = None, until: float = None,
+                         limit: int = None) -> List[nucleo.DiagnosisResult]:
+        """Diagnoses that found a deficiency between two timestamps, newest first"""
+        rows = self._query(
+            'SELECT d.sintomas, d.deficiencias, d.tratamientos '
+            'FROM deficiencias_diagnosticadas AS c JOIN diagnosticos AS d ON d.id = c.diagnostico '
+            'WHERE c.deficiencia = ? AND c.fecha >= ? AND c.fecha < ? ORDER BY c.fecha DESC LIMIT ?',
+            (deficiency, *self._range(since, until), -1 if limit is None else limit))
+        return [nucleo.DiagnosisResult(tuple(map(tuple, json.loads(symptoms))), tuple(json.loads(deficiencies)),
+                                tuple(json.loads(treatments)))
+                for symptoms, deficiencies, treatments in rows]
+    
+    def deficiency_counts(self, since: float = None, until: float = None) -> Dict[str, int]:
+        """Diagnoses per deficiency, over whole days (UTC) between two timestamps"""
+        first, last = self._days(since, until)
+        rows = self._query('SELECT deficiencia, SUM(total) FROM resumen_deficiencias '
+                           'WHERE dia >= ? AND dia < ? GROUP BY deficiencia ORDER BY 2 DESC', (first, last))
+        return dict(rows)
+    
+    def recommendation_distribution(self, since: float = None, until: float = None) -> Dict[int, Dict[str, int]]:
+        """Recommended plants per 1-unit pH band (band 6 is 6 <= pH < 7), over whole days (UTC)"""
+        first, last = self._days(since, until)
+        distribution = {}
+        for band, plant, total in self._query(
+                'SELECT banda, planta, SUM(total) FROM resumen_recomendaciones '
+                'WHERE dia >= ? AND dia < ? GROUP BY banda, planta ORDER BY banda, planta', (first, last)):
+            distribution.setdefault(band, {})[plant] = total
+        return distribution
+    
+    @staticmethod
+    def _days(since: float = None, until: float = None) -> Tuple[int, int]:
+        """Day numbers covering [since, until)"""
+        first = -2 ** 62 if since is None else int(since // SECONDS_PER_DAY)
+        last = 2 ** 62 if until is None else int(-(-until // SECONDS_PER_DAY))
+        return first, last
+    
+    def close(self):
+        """Write what is still buffered and close the database"""
+        with self._lock:
+            if self._connection is None:
+                return
+            self.flush()
+            self._connection.close()
+            self._connection = None
+        atexit.unregister(self.close)
+
+
+def record_history(results: Iterable[Dict], store: HistoryStore) -> Iterator[Dict]:
+    """Pass pipeline results through, saving their diagnosis and recommendation to a history store
+    
+    Records whose symptoms or inputs were rejected have no diagnosis or
+    recommendation, and nothing is saved for them.
+    """
+    for result in results:
+        if result['deficiencias'] is not None:
+            symptoms = nucleo.normalize_symptoms({category: result.get(category)
+                                                  for category in nucleo.SYMPTOM_CATEGORIES})
+            store.record_diagnosis(nucleo.DiagnosisResult(symptoms, tuple(result['deficiencias']),
+                                                          tuple(result['tratamientos'])))
+        if result['valor'] is not None:
+            store.record_recommendation(nucleo.Recommendation(nucleo.parse_number(result[nucleo.RECORD_PH]),
+                                                              nucleo.parse_number(result[nucleo.RECORD_RIEGO]),
+                                                              result['valor'], result['planta']))
+        yield result
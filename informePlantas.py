@@ -0,0 +1,279 @@
+"""Headless (Agg) report of the fuzzy plant recommender
+
+Renders the decision surface, the membership functions and one result chart
+per sample of a table (parcela, ph, riego), in parallel worker processes:
+
+    python sistemaPlantas.py --headless --report informe/ muestras.csv -o informe.jsonl --workers 4
+"""
+from __future__ import annotations
+
+import functools
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+import nucleoPlantas as nucleo
+
+np = nucleo.LazyModule('numpy', 'np', globals())
+
+
+# File formats the report renderer can write
+REPORT_FORMATS = ('png', 'svg')
+
+
+def _file_name(plot, index: int = None) -> str:
+    """File-system safe name for a plot identifier, prefixed with its row index to keep it unique"""
+    name = re.sub(r'[^\w.-]+', '_', str(plot)).strip('._') or 'parcela'
+    return name if index is None else f'{index}-{name}'
+
+
+class ReportFile(NamedTuple):
+    """One per-sample chart written by ReportRenderer, or the reason it was not"""
+    plot: object
+    path: str
+    value: float
+    plant: str
+    error: str
+
+
+class ReportRenderer:
+    """Headless (Agg) rendering of the recommender's report figures
+    
+    Per-sample result charts reuse one RecommendationPlot: each sample only
+    swaps its output fills, result line and title. For PNG the static part
+    (axes, ticks, curves, legend) is rasterized once and every chart restores
+    it and draws just those artists on top (blitting), with the curves and the
+    legend (pinned where the first draw placed it) again over the fills; SVG
+    charts go through a full savefig. Figures are plain
+    matplotlib Figures with their own Agg canvas, never registered with
+    pyplot, so nothing is kept alive between charts; the one-off figures
+    (decision surface, membership functions) are cleared as soon as they are
+    saved, even when saving fails.
+    """
+    
+    def __init__(self, fuzzy_system: nucleo.FuzzySystem = None, fmt: str = 'png', dpi: int = 100):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Formato de informe no soportado: {fmt}")
+        self.fuzzy_system = fuzzy_system if fuzzy_system is not None else nucleo.create_fuzzy_system()
+        self.model = nucleo.VectorizedFuzzyEngine(self.fuzzy_system)
+        self.evaluation = nucleo.FuzzyEvaluation(self.model)
+        self.fmt = fmt
+        self.dpi = dpi
+        self.plot = nucleo.RecommendationPlot(self.fuzzy_system.planta)
+        self.canvas = FigureCanvasAgg(self.plot.figure)
+        self.title = self.plot.ax.set_title('')
+        self.curves = [line for line in self.plot.ax.lines if line is not self.plot.result_line]
+        self.background = None
+        if fmt == 'png':
+            self.plot.result_line.set_animated(True)
+            self.title.set_animated(True)
+            self.plot.figure.set_dpi(dpi)
+            self.canvas.draw()
+            legend = self.plot.ax.get_legend()
+            corner = self.plot.ax.transAxes.inverted().transform(legend.get_window_extent().p0)
+            legend.set_loc(tuple(corner))
+            legend.set_animated(True)
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.plot.figure.bbox)
+    
+    def _new_figure(self, figsize: Tuple[float, float]):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        figure = Figure(figsize=figsize)
+        FigureCanvasAgg(figure)
+        return figure
+    
+    def _save(self, figure, path: str):
+        start = time.perf_counter()
+        figure.savefig(path, format=self.fmt, dpi=self.dpi)
+        nucleo.METRICS.observe('report_render', time.perf_counter() - start)
+    
+    def _blit(self, path: str):
+        """Write the reused chart from its cached background and the per-sample artists"""
+        from matplotlib.image import imsave
+        start = time.perf_counter()
+        ax = self.plot.ax
+        self.canvas.restore_region(self.background)
+        for artist in self.plot.output_fills + self.curves + [self.plot.result_line, self.plot.ax.get_legend(),
+                                                              self.title]:
+            ax.draw_artist(artist)
+        imsave(path, np.asarray(self.canvas.buffer_rgba()), format='png', dpi=self.dpi)
+        nucleo.METRICS.observe('report_render', time.perf_counter() - start)
+    
+    def render_sample(self, directory: str, plot, ph_value, riego_value, index: int = None) -> ReportFile:
+        """Write the result chart of one sample as directory/[<index>-]<plot>.<fmt>
+        
+        pH and riego may be raw record fields; missing or invalid ones give a
+        ReportFile with the error instead of a chart.
+        """
+        try:
+            ph_value, riego_value = nucleo.parse_inputs(ph_value, riego_value)
+            self.evaluation.input['acidez'] = ph_value
+            self.evaluation.input['riego'] = riego_value
+            self.evaluation.compute()
+        except (TypeError, ValueError) as e:
+            return ReportFile(plot, None, None, None, str(e))
+        value = self.evaluation.output['planta']
+        plant = nucleo.recommend_plant(value)
+        self.plot.update(value, self.evaluation.cuts)
+        self.title.set_text(f"{plot}: {plant} ({value:.2f}) - pH {ph_value:g}, riego {riego_value:g}")
+        path = os.path.join(directory, f"{_file_name(plot, index)}.{self.fmt}")
+        if self.background is not None:
+            self._blit(path)
+        else:
+            self._save(self.plot.figure, path)
+        return ReportFile(plot, path, value, plant, None)
+    
+    def render_memberships(self, path: str):
+        """Membership functions of acidez, riego and planta, one panel each"""
+        figure = self._new_figure((12, 4))
+        try:
+            for ax, variable in zip(figure.subplots(1, 3), self.fuzzy_system[:3]):
+                for term_name, term in variable.terms.items():
+                    ax.plot(variable.universe, term.mf, label=term_name, linewidth=1.5)
+                ax.set_ylim([0, 1.01])
+                ax.set_xlim([variable.universe.min(), variable.universe.max()])
+                ax.set_xlabel(variable.label)
+                ax.set_ylabel('Membership')
+                ax.spines['top'].set_visible(False)
+                ax.spines['right'].set_visible(False)
+                ax.legend(framealpha=0.5)
+            figure.tight_layout()
+            self._save(figure, path)
+        finally:
+            figure.clear()
+    
+    def render_surface(self, path: str, ph_step: float = 0.05, riego_step: float = 0.05):
+        """Crisp output over the whole pH x riego plane, with the plant boundaries"""
+        ph_values = np.arange(0, 14 + ph_step / 2, ph_step)
+        riego_values = np.arange(0, 10 + riego_step / 2, riego_step)
+        grid_ph, grid_riego = np.meshgrid(ph_values, riego_values)
+        surface = self.model.compute(grid_ph, grid_riego).reshape(grid_ph.shape)
+        figure = self._new_figure((7, 5))
+        try:
+            ax = figure.add_subplot()
+            mesh = ax.pcolormesh(ph_values, riego_values, surface, shading='auto', cmap='viridis')
+            boundaries = ax.contour(ph_values, riego_values, surface, levels=nucleo.PLANT_THRESHOLDS, colors='white',
+                                    linewidths=1.5)
+            ax.clabel(boundaries, fmt='%.1f')
+            colorbar = figure.colorbar(mesh, ax=ax)
+            colorbar.set_label(self.fuzzy_system.planta.label)
+            ax.set_xlabel(self.fuzzy_system.acidez.label)
+            ax.set_ylabel(self.fuzzy_system.riego.label)
+            ax.set_title(' / '.join(nucleo.PLANT_NAMES))
+            self._save(figure, path)
+        finally:
+            figure.clear()
+    
+    def close(self):
+        """Release the reused figure"""
+        self.plot.figure.clear()
+
+
+# Report renderer of the current pool worker process
+_worker_renderer = None
+
+
+def _init_report_worker(fmt: str, dpi: int):
+    """Select Agg and build the worker's renderer once, when the process starts"""
+    global _worker_renderer
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker_renderer = ReportRenderer(fmt=fmt, dpi=dpi)
+
+
+def _render_chunk(directory: str, chunk: List[Tuple[int, object, float, float]]) -> List[ReportFile]:
+    """Render one shard of numbered samples in a pool worker"""
+    return [_worker_renderer.render_sample(directory, plot, ph_value, riego_value, index)
+            for index, plot, ph_value, riego_value in chunk]
+
+
+def _render_overview(directory: str) -> List[str]:
+    """Render the decision surface and the membership plots in a pool worker"""
+    paths = [os.path.join(directory, f'superficie.{_worker_renderer.fmt}'),
+             os.path.join(directory, f'pertenencias.{_worker_renderer.fmt}')]
+    _worker_renderer.render_surface(paths[0])
+    _worker_renderer.render_memberships(paths[1])
+    return paths
+
+
+class ReportPool:
+    """Parallel headless rendering of report charts over worker processes
+    
+    Every worker selects the Agg backend and keeps one ReportRenderer for its
+    lifetime. Samples are sent in chunks of chunksize and results come back in
+    submission order, with at most max_pending chunks in flight. With
+    max_tasks_per_child, workers are replaced after that many chunks, which
+    caps whatever a long run could still accumulate inside matplotlib.
+    """
+    
+    def __init__(self, workers: int = None, fmt: str = 'png', dpi: int = 100, chunksize: int = 64,
+                 max_pending: int = None, max_tasks_per_child: int = None):
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Formato de informe no soportado: {fmt}")
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.max_pending = max_pending or 2 * self.workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_report_worker,
+            initargs=(fmt, dpi),
+            max_tasks_per_child=max_tasks_per_child
+        )
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """Shut the worker processes down"""
+        self.executor.shutdown()
+    
+    def render_overview(self, directory: str):
+        """Start rendering the decision surface and membership plots; returns a future of their paths"""
+        return self.executor.submit(_render_overview, directory)
+    
+    def render_many(self, directory: str, samples: Iterable[Tuple[object, float, float]]) -> Iterator[ReportFile]:
+        """Render the chart of every (plot, ph, riego) sample, yielding results in input order
+        
+        Files are named after the plot and the sample's position, so repeated
+        or similar plot identifiers never overwrite each other.
+        """
+        samples = ((index, *sample) for index, sample in enumerate(samples))
+        yield from nucleo.map_chunks(self.executor, functools.partial(_render_chunk, directory), samples,
+                                     self.chunksize, self.max_pending)
+
+
+def run_report(input_path: str = '-', directory: str = 'informe', output_path: str = '-', input_format: str = None,
+               fmt: str = 'png', workers: int = None, max_tasks_per_child: int = None) -> Dict[str, int]:
+    """Render the report of a table of samples (parcela, ph, riego) into directory
+    
+    Writes the decision surface, the membership plots and one result chart
+    per sample, in parallel; each sample's file (or error) is written as a
+    JSONL line to output_path. Returns the number of charts and errors.
+    """
+    input_format = input_format or nucleo.guess_format(input_path)
+    os.makedirs(directory, exist_ok=True)
+    counts = {'graficos': 0, 'errores': 0}
+    
+    def samples(source):
+        # Fields are parsed and validated by the workers, which report bad ones
+        for index, record in enumerate(nucleo.read_records(source, input_format)):
+            yield record.get(nucleo.RECORD_PLOT) or index, record.get(nucleo.RECORD_PH), record.get(nucleo.RECORD_RIEGO)
+    
+    def counted(reports):
+        for report in reports:
+            counts['errores' if report.error else 'graficos'] += 1
+            yield report._asdict()
+    
+    with nucleo.open_records(input_path, output_path) as (source, target):
+        with ReportPool(workers, fmt, max_tasks_per_child=max_tasks_per_child) as pool:
+            overview = pool.render_overview(directory)
+            nucleo.write_records(counted(pool.render_many(directory, samples(source))), target, 'jsonl')
+            overview.result()
+    return counts
@@ -0,0 +1,280 @@
+"""Diagnosis by integer bitmasks compiled from the CLIPS rule base
+
+An alternative to running CLIPS for every report, for the server
+(--diagnosis-engine bitmask) and large headless batches; checked against
+CLIPS with
+
+    python sistemaPlantas.py --verify-engines
+"""
+from __future__ import annotations
+
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+import nucleoPlantas as nucleo
+
+np = nucleo.LazyModule('numpy', 'np', globals())
+
+
+class _Quoted(str):
+    """A quoted string token, as opposed to a symbol, in a parsed construct"""
+
+
+def _parse_sexpr(text: str):
+    """Parse one CLIPS construct into nested lists of symbols and _Quoted strings"""
+    stack = [[]]
+    for token in re.findall(r'"(?:[^"\\]|\\.)*"|[()]|[^\s()]+', text):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            item = stack.pop()
+            stack[-1].append(item)
+        elif token.startswith('"'):
+            stack[-1].append(_Quoted(re.sub(r'\\(.)', r'\1', token[1:-1])))
+        else:
+            stack[-1].append(token)
+    return stack[0][0]
+
+
+class BitmaskDiagnosisEngine:
+    """Diagnosis by integer bitmasks compiled from the CLIPS rule base
+    
+    Rules whose left-hand side is a single pattern, or an (or ...) of patterns,
+    matching literal facts, and whose right-hand side only asserts literal
+    facts (the shape of the deficiency and treatment rules) compile into a
+    condition mask and an action mask over one bit per literal fact. A report
+    is then a few AND/OR operations until no rule adds a fact, and
+    diagnose_matrix() does the same for a whole batch over the sparse
+    incidence of rules and facts. If any rule cannot be compiled, every
+    report falls back to CLIPS.
+    Results hold the same deficiencies and treatments as CLIPS, listed in rule
+    order rather than agenda order. Environments loaded from a binary
+    snapshot keep no rule source and always use CLIPS.
+    """
+    
+    def __init__(self, env=None):
+        self.env = env if env is not None else nucleo.create_expert_system()
+        self.rules_hash = nucleo.rule_base_hash(self.env)
+        self.slots = {template.name: {slot.name for slot in template.slots} for template in self.env.templates()}
+        self.bits = {}
+        self.rules = []
+        self.unsupported = []
+        for rule in self.env.rules():
+            # Binary-loaded rules keep no source and stay with CLIPS
+            source = str(rule)
+            compiled = self._compile(_parse_sexpr(source)) if source else None
+            if compiled is None:
+                self.unsupported.append(rule.name)
+            else:
+                self.rules.append(compiled)
+        self.fallback = nucleo.DiagnosisEngine(self.env) if self.unsupported else None
+        
+        # Bits of the facts callers assert and of the facts reported back
+        self.symptom_bits = {
+            (dict(slots)['categoria'], dict(slots)['caracteristica']): 1 << bit
+            for (template, slots), bit in self.bits.items() if template == 'sintoma'
+        }
+        self.deficiency_bits = [(1 << bit, dict(slots)['deficiencia'])
+                                for (template, slots), bit in self.bits.items() if template == 'diagnostico']
+        self.treatment_bits = [(1 << bit, dict(slots)['recomendacion'])
+                               for (template, slots), bit in self.bits.items() if template == 'tratamiento']
+        self._matrices = None
+        self._sparse = None
+    
+    def build(self, construct: str):
+        """Add or redefine a construct in the rule base and recompile"""
+        self.env.build(construct)
+        self.refresh_rules_hash()
+    
+    def undefine(self, rule: str):
+        """Remove a rule from the rule base and recompile"""
+        self.env.find_rule(rule).undefine()
+        self.refresh_rules_hash()
+    
+    def refresh_rules_hash(self):
+        """Recompile after the environment's rules changed, updating rules_hash"""
+        self.__init__(self.env)
+    
+    def _fact(self, pattern):
+        """Bit of a pattern naming every slot of its template with a literal string, or None"""
+        if not isinstance(pattern, list) or not pattern or pattern[0] not in self.slots:
+            return None
+        slots = []
+        for slot in pattern[1:]:
+            if not (isinstance(slot, list) and len(slot) == 2 and isinstance(slot[1], _Quoted)):
+                return None
+            slots.append((slot[0], str(slot[1])))
+        if {name for name, _ in slots} != self.slots[pattern[0]]:
+            return None
+        key = (pattern[0], tuple(sorted(slots)))
+        if key not in self.bits:
+            self.bits[key] = len(self.bits)
+        return self.bits[key]
+    
+    def _compile(self, construct):
+        """(condition mask, action mask) of a defrule, or None when it has another shape"""
+        body = [item for item in construct[2:] if not isinstance(item, _Quoted)]
+        if '=>' not in body:
+            return None
+        arrow = body.index('=>')
+        lhs, rhs = body[:arrow], body[arrow + 1:]
+        if len(lhs) != 1 or not rhs:
+            return None
+        # Truth maintenance does not change what a report derives from scratch
+        if lhs[0][:1] == ['logical'] and len(lhs[0]) == 2:
+            lhs = lhs[0][1:]
+        patterns = lhs[0][1:] if lhs[0][:1] == ['or'] else lhs
+        
+        condition = 0
+        for pattern in patterns:
+            bit = self._fact(pattern)
+            if bit is None:
+                return None
+            condition |= 1 << bit
+        action = 0
+        for call in rhs:
+            if not (isinstance(call, list) and call[:1] == ['assert'] and len(call) > 1):
+                return None
+            for fact in call[1:]:
+                bit = self._fact(fact)
+                if bit is None:
+                    return None
+                action |= 1 << bit
+        return condition, action
+    
+    def _chain(self, state: int) -> int:
+        """Fire rules until no new fact is added"""
+        while True:
+            new_state = state
+            for condition, action in self.rules:
+                if new_state & condition:
+                    new_state |= action
+            if new_state == state:
+                return state
+            state = new_state
+    
+    def diagnose(self, symptoms: nucleo.SymptomSet) -> nucleo.DiagnosisResult:
+        """Diagnose a single symptom set"""
+        if self.fallback is not None:
+            return self.fallback.diagnose(symptoms)
+        selected = nucleo.normalize_symptoms(symptoms)
+        state = 0
+        for category, symptom in selected:
+            state |= self.symptom_bits.get((category, symptom), 0)
+        state = self._chain(state)
+        return nucleo.DiagnosisResult(
+            selected,
+            tuple(value for mask, value in self.deficiency_bits if state & mask),
+            tuple(value for mask, value in self.treatment_bits if state & mask)
+        )
+    
+    def diagnose_many(self, symptom_sets: Iterable[nucleo.SymptomSet]) -> Iterator[nucleo.DiagnosisResult]:
+        """Diagnose every symptom set, yielding results in input order"""
+        for symptoms in symptom_sets:
+            yield self.diagnose(symptoms)
+    
+    def matrices(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Fact x rule condition and rule x fact action incidence matrices, as booleans"""
+        if self._matrices is None:
+            conditions = np.zeros((len(self.bits), len(self.rules)), dtype=bool)
+            actions = np.zeros((len(self.rules), len(self.bits)), dtype=bool)
+            for rule, (condition, action) in enumerate(self.rules):
+                conditions[_set_bits(condition), rule] = True
+                actions[rule, _set_bits(action)] = True
+            self._matrices = (conditions, actions)
+        return self._matrices
+    
+    def _incidence(self):
+        """Sparse form of matrices(): condition facts grouped by rule and asserting rules grouped by fact"""
+        if self._sparse is None:
+            conditions, actions = self.matrices()
+            condition_rules, condition_facts = np.nonzero(conditions.T)
+            action_facts, action_rules = np.nonzero(actions.T)
+            rules, rule_starts = np.unique(condition_rules, return_index=True)
+            facts, fact_starts = np.unique(action_facts, return_index=True)
+            self._sparse = (condition_facts, rules, rule_starts, action_rules, facts, fact_starts)
+        return self._sparse
+    
+    def diagnose_matrix(self, symptom_sets: List[nucleo.SymptomSet]) -> np.ndarray:
+        """Final fact state of a batch of reports as an (N, facts) boolean matrix
+        
+        Each step ORs the condition facts of every rule and then the firing of
+        every rule asserting a fact, over the sparse incidence lists, so the
+        work follows the number of rule/fact links rather than rules x facts.
+        """
+        condition_facts, rules, rule_starts, action_rules, facts, fact_starts = self._incidence()
+        state = np.zeros((len(symptom_sets), len(self.bits)), dtype=bool)
+        for row, symptoms in enumerate(symptom_sets):
+            for category, symptom in nucleo.normalize_symptoms(symptoms):
+                mask = self.symptom_bits.get((category, symptom))
+                if mask is not None:
+                    state[row, mask.bit_length() - 1] = True
+        if not len(rules) or not len(facts):
+            return state
+        fired = np.zeros((len(symptom_sets), len(self.rules)), dtype=bool)
+        while True:
+            fired[:, rules] = np.logical_or.reduceat(state[:, condition_facts], rule_starts, axis=1)
+            asserted = np.logical_or.reduceat(fired[:, action_rules], fact_starts, axis=1)
+            if not (asserted & ~state[:, facts]).any():
+                return state
+            state[:, facts] |= asserted
+    
+    def diagnose_batch(self, symptom_sets: Iterable[nucleo.SymptomSet]) -> List[nucleo.DiagnosisResult]:
+        """Diagnose a whole batch with array operations"""
+        symptom_sets = [nucleo.normalize_symptoms(symptoms) for symptoms in symptom_sets]
+        if self.fallback is not None:
+            return [self.fallback.diagnose(symptoms) for symptoms in symptom_sets]
+        state = self.diagnose_matrix(symptom_sets)
+        deficiencies = _row_values(state, self.deficiency_bits)
+        treatments = _row_values(state, self.treatment_bits)
+        return [nucleo.DiagnosisResult(symptoms, deficiency, treatment)
+                for symptoms, deficiency, treatment in zip(symptom_sets, deficiencies, treatments)]
+
+
+def _set_bits(mask: int) -> List[int]:
+    """Positions of the bits set in an integer mask"""
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low.bit_length() - 1)
+        mask ^= low
+    return bits
+
+
+def _row_values(state: np.ndarray, masks: List[Tuple[int, str]]) -> List[Tuple[str, ...]]:
+    """For each row of a fact state matrix, the values whose fact bit is set, in masks order"""
+    columns = [mask.bit_length() - 1 for mask, _ in masks]
+    values = [value for _, value in masks]
+    rows, positions = np.nonzero(state[:, columns])
+    ends = np.cumsum(np.bincount(rows, minlength=len(state))).tolist()
+    positions = positions.tolist()
+    start = 0
+    result = []
+    for end in ends:
+        result.append(tuple(values[position] for position in positions[start:end]))
+        start = end
+    return result
+
+
+def check_bitmask_equivalence(symptom_sets: List[nucleo.SymptomSet] = None, env=None) -> List[Tuple]:
+    """Compare the bitmask engine against CLIPS on every symptom combination
+    
+    Both the per-report and the batch paths are checked; returns the
+    mismatching (symptoms, clips result, bitmask result) triples, empty when
+    the engines agree.
+    """
+    symptom_sets = symptom_sets if symptom_sets is not None else nucleo.all_symptom_sets()
+    clips_engine = nucleo.DiagnosisEngine(env)
+    bitmask_engine = BitmaskDiagnosisEngine(env)
+    
+    def same(a, b):
+        return set(a.deficiencies) == set(b.deficiencies) and set(a.treatments) == set(b.treatments)
+    
+    mismatches = []
+    batch = bitmask_engine.diagnose_batch(symptom_sets)
+    for symptoms, batch_result in zip(symptom_sets, batch):
+        expected = clips_engine.diagnose(symptoms)
+        result = bitmask_engine.diagnose(symptoms)
+        if not (same(expected, result) and same(expected, batch_result)):
+            mismatches.append((symptoms, expected, result))
+    return mismatches
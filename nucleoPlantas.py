@@ -0,0 +1,1455 @@
+"""Core of the plant diagnosis and recommendation system, without any interface
+
+The knowledge base and the CLIPS expert system generated from it, the fuzzy
+plant recommender, the phase metrics and the field records read and written
+by the headless modes. The Tk interface and command line (sistemaPlantas.py)
+and the other modules (historialPlantas.py, servidorPlantas.py, ...) are
+built on top of this one, which imports none of them.
+"""
+from __future__ import annotations
+
+import atexit
+import bisect
+import contextlib
+import csv
+import functools
+import hashlib
+import importlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, islice, product
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+
+class LazyModule:
+    """Stand-in for a heavy dependency, imported on first attribute access
+    
+    The first access replaces the stand-in in namespace (the globals() of the
+    module that created it) with the real module, so later uses cost nothing
+    extra.
+    """
+    
+    def __init__(self, name: str, alias: str, namespace: Dict):
+        self._name = name
+        self._alias = alias
+        self._namespace = namespace
+    
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        self._namespace[self._alias] = module
+        return getattr(module, attr)
+
+
+# Heavy dependencies are only loaded by the engine or API that needs them
+clips = LazyModule('clips', 'clips', globals())
+np = LazyModule('numpy', 'np', globals())
+fuzz = LazyModule('skfuzzy', 'fuzz', globals())
+ctrl = LazyModule('skfuzzy.control', 'ctrl', globals())
+
+
+class Metrics:
+    """Event counters and latency histograms of the instrumented phases
+    
+    Recording is a perf_counter() difference, a bisect and a few additions
+    under a lock, so it stays on in production. Snapshots can be exported as
+    JSON or in the Prometheus text format.
+    """
+    
+    # Histogram bucket upper bounds, in seconds
+    BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+    
+    def observe(self, phase: str, seconds: float):
+        """Record the duration of one execution of a phase"""
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = self.histograms[phase] = {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(self.BUCKETS) + 1)}
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['buckets'][index] += 1
+    
+    def increment(self, event: str, value: int = 1):
+        """Add to an event counter"""
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + value
+    
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+    
+    def snapshot(self) -> Dict:
+        """Current counters and histograms, with cumulative bucket counts"""
+        with self._lock:
+            phases = {}
+            for phase, histogram in self.histograms.items():
+                cumulative = list(accumulate(histogram['buckets']))
+                phases[phase] = {
+                    'count': histogram['count'],
+                    'sum': histogram['sum'],
+                    'buckets': {str(bound): count for bound, count in zip(self.BUCKETS + ('+Inf',), cumulative)}
+                }
+            return {'phases': phases, 'counters': dict(self.counters)}
+    
+    def to_json(self) -> str:
+        """Snapshot as a JSON document"""
+        return json.dumps(self.snapshot(), indent=2)
+    
+    def to_prometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP plantas_phase_seconds Duration of the instrumented phases.",
+            "# TYPE plantas_phase_seconds histogram"
+        ]
+        for phase, histogram in snapshot['phases'].items():
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'plantas_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {count}')
+            lines.append(f'plantas_phase_seconds_sum{{phase="{phase}"}} {histogram["sum"]}')
+            lines.append(f'plantas_phase_seconds_count{{phase="{phase}"}} {histogram["count"]}')
+        lines += [
+            "# HELP plantas_events_total Counted events.",
+            "# TYPE plantas_events_total counter"
+        ]
+        for event, count in snapshot['counters'].items():
+            lines.append(f'plantas_events_total{{event="{event}"}} {count}')
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, path: str):
+        """Write a snapshot to a file; .prom/.txt files get the Prometheus format, anything else JSON"""
+        prometheus = os.path.splitext(path)[1].lower() in ('.prom', '.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus() if prometheus else self.to_json())
+
+
+# Process-wide metrics of the diagnosis, recommendation and plotting phases
+METRICS = Metrics()
+
+
+def timed(phase: str, function):
+    """Wrap a callable so every call is recorded as a phase in METRICS"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            METRICS.observe(phase, time.perf_counter() - start)
+    return wrapper
+
+
+def _install_profiler(target: str):
+    """Profile the whole process with cProfile and report at exit
+    
+    target is a .prof file for the binary stats (for pstats/snakeviz), or
+    '1' to print the 30 most expensive functions to stderr.
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    
+    def report():
+        profiler.disable()
+        if target.endswith('.prof'):
+            profiler.dump_stats(target)
+        else:
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+    
+    atexit.register(report)
+    profiler.enable()
+
+
+# Opt-in hooks, switched on from the environment:
+#   PLANTAS_PROFILE=salida.prof (or 1)  profile the process with cProfile
+#   PLANTAS_METRICS=metricas.json|.prom  dump METRICS when the process exits
+if os.environ.get('PLANTAS_PROFILE'):
+    _install_profiler(os.environ['PLANTAS_PROFILE'])
+if os.environ.get('PLANTAS_METRICS'):
+    atexit.register(METRICS.write, os.environ['PLANTAS_METRICS'])
+
+
+# Symptom catalog, deficiencies and treatments
+KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseConocimiento.json')
+
+# Where compiled (bsave) rule bases are cached
+SNAPSHOT_DIR = os.environ.get('PLANTAS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sistemaPlantas'))
+
+# Templates shared by every knowledge base
+EXPERT_SYSTEM_TEMPLATES = [
+    "(deftemplate diagnostico (slot deficiencia (type STRING)))",
+    "(deftemplate sintoma (slot categoria (type STRING)) (slot caracteristica (type STRING)))",
+    "(deftemplate tratamiento (slot recomendacion (type STRING)))"
+]
+
+
+def load_knowledge_base(path: str = KNOWLEDGE_BASE_PATH) -> Dict:
+    """Read the symptom catalog, deficiencies and treatments from a JSON file"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+KNOWLEDGE_BASE = load_knowledge_base()
+
+# Symptom categories and options
+SYMPTOM_CATEGORIES = KNOWLEDGE_BASE['sintomas']
+
+# A set of symptoms is either {category: symptom} or an iterable of (category, symptom) pairs
+SymptomSet = Union[Dict[str, str], Iterable[Tuple[str, str]]]
+
+
+def _clips_string(value: str) -> str:
+    """Quote a Python string as a CLIPS string literal"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def expert_system_constructs(knowledge_base: Dict = None) -> List[str]:
+    """CLIPS templates and rules generated from a knowledge base
+    
+    Rule conditions are logical, so diagnostico and tratamiento facts are
+    retracted by CLIPS when the facts supporting them go away (see
+    IncrementalDiagnosis).
+    """
+    knowledge_base = knowledge_base if knowledge_base is not None else KNOWLEDGE_BASE
+    deficiencies = knowledge_base['deficiencias']
+    constructs = list(EXPERT_SYSTEM_TEMPLATES)
+    
+    # Rules for nutrient deficiencies
+    for deficiency, data in deficiencies.items():
+        patterns = ' '.join(
+            f'(sintoma (categoria {_clips_string(category)}) (caracteristica {_clips_string(symptom)}))'
+            for category, symptom, *_ in data['sintomas']
+        )
+        constructs.append(
+            f'(defrule {deficiency}-deficiencia (logical (or {patterns})) '
+            f'=> (assert (diagnostico (deficiencia {_clips_string(deficiency)}))))'
+        )
+    
+    # Treatment rules
+    for deficiency, data in deficiencies.items():
+        constructs.append(
+            f'(defrule {deficiency}-tratamiento (logical (diagnostico (deficiencia {_clips_string(deficiency)}))) '
+            f'=> (assert (tratamiento (recomendacion {_clips_string(data["tratamiento"])}))))'
+        )
+    return constructs
+
+
+def _snapshot_path(constructs: List[str]) -> str:
+    """Snapshot file of a rule base, named after the hash of its source"""
+    digest = hashlib.sha256('\n'.join(constructs).encode('utf-8')).hexdigest()
+    return os.path.join(SNAPSHOT_DIR, f'reglas-{digest[:32]}.bin')
+
+
+def create_expert_system(knowledge_base: Dict = None, snapshot: bool = False):
+    """Create the CLIPS expert system environment
+    
+    With snapshot=True the compiled rule base is loaded with bload from a
+    binary image keyed by the hash of the generated constructs, and the image
+    is written (bsave) the first time. Binary-loaded environments start much
+    faster but keep no rule source (str(rule) is empty) and accept no new
+    constructs.
+    """
+    constructs = expert_system_constructs(knowledge_base)
+    path = _snapshot_path(constructs) if snapshot else None
+    
+    if path is not None and os.path.exists(path):
+        env = clips.Environment()
+        try:
+            env.load(path, binary=True)
+            return env
+        except clips.CLIPSError:
+            # Stale or corrupt image: rebuild it below
+            pass
+    
+    env = clips.Environment()
+    env.clear()
+    for construct in constructs:
+        env.build(construct)
+    
+    if path is not None:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        # Keep the slot type constraints in the binary image; the previous
+        # setting comes back as the symbol TRUE or FALSE
+        checking = env.eval('(set-dynamic-constraint-checking TRUE)')
+        env.save(temporary, binary=True)
+        env.eval(f"(set-dynamic-constraint-checking {checking})")
+        os.replace(temporary, path)
+    return env
+
+
+def rule_base_hash(env) -> str:
+    """Hash of the templates and rules loaded in a CLIPS environment
+    
+    Binary-loaded rules have no source, so only their names count for them.
+    """
+    source = '\n'.join([f'{template.name} {template}' for template in env.templates()]
+                       + [f'{rule.name} {rule}' for rule in env.rules()])
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+class DiagnosisResult(NamedTuple):
+    """Structured result of a single diagnosis"""
+    symptoms: Tuple[Tuple[str, str], ...]
+    deficiencies: Tuple[str, ...]
+    treatments: Tuple[str, ...]
+
+
+def normalize_symptoms(symptoms: SymptomSet) -> Tuple[Tuple[str, str], ...]:
+    """Turn a symptom set into a tuple of (category, symptom) pairs, dropping empty selections"""
+    if isinstance(symptoms, dict):
+        symptoms = symptoms.items()
+    return tuple((category, symptom) for category, symptom in symptoms if symptom)
+
+
+def validate_symptoms(symptoms: Dict[str, str]):
+    """Raise ValueError if a selected symptom is not text (empty selections are None or '')"""
+    for category, symptom in symptoms.items():
+        if symptom is not None and not isinstance(symptom, str):
+            raise ValueError(f"El síntoma de '{category}' debe ser texto.")
+
+
+class DiagnosisEngine:
+    """Headless diagnosis on top of one warm CLIPS environment
+    
+    The rule base is built once by create_expert_system() and reused for every
+    report; only working memory is reset between diagnoses.
+    """
+    
+    def __init__(self, env=None):
+        self.env = env if env is not None else create_expert_system()
+        self.sintoma = self.env.find_template('sintoma')
+        self.rules_hash = rule_base_hash(self.env)
+        self.reports = 0
+        self.elapsed = 0.0
+    
+    def build(self, construct: str):
+        """Add or redefine a construct in the rule base (not possible on a binary snapshot)"""
+        self.env.build(construct)
+        self.refresh_rules_hash()
+    
+    def undefine(self, rule: str):
+        """Remove a rule from the rule base"""
+        self.env.find_rule(rule).undefine()
+        self.refresh_rules_hash()
+    
+    def refresh_rules_hash(self):
+        """Recompute the rule base hash, after changing the environment directly"""
+        self.rules_hash = rule_base_hash(self.env)
+    
+    def diagnose(self, symptoms: SymptomSet) -> DiagnosisResult:
+        """Diagnose a single symptom set"""
+        start = time.perf_counter()
+        selected = normalize_symptoms(symptoms)
+        
+        # Reset working memory and assert the symptoms through the template
+        self.env.reset()
+        reset_done = time.perf_counter()
+        for category, symptom in selected:
+            self.sintoma.assert_fact(categoria=category, caracteristica=symptom)
+        assert_done = time.perf_counter()
+        
+        # Run the expert system
+        self.env.run()
+        run_done = time.perf_counter()
+        
+        # Collect diagnoses and treatments in a single pass, keeping assertion order
+        deficiencies = {}
+        treatments = {}
+        for fact in self.env.facts():
+            name = fact.template.name
+            if name == 'diagnostico':
+                deficiencies[fact['deficiencia']] = None
+            elif name == 'tratamiento':
+                treatments[fact['recomendacion']] = None
+        end = time.perf_counter()
+        
+        METRICS.observe('diagnosis_reset', reset_done - start)
+        METRICS.observe('diagnosis_assert', assert_done - reset_done)
+        METRICS.observe('diagnosis_run', run_done - assert_done)
+        METRICS.observe('diagnosis_facts', end - run_done)
+        METRICS.observe('diagnosis', end - start)
+        self.reports += 1
+        self.elapsed += end - start
+        return DiagnosisResult(selected, tuple(deficiencies), tuple(treatments))
+    
+    def diagnose_many(self, symptom_sets: Iterable[SymptomSet]) -> Iterator[DiagnosisResult]:
+        """Diagnose every symptom set, yielding results in input order"""
+        for symptoms in symptom_sets:
+            yield self.diagnose(symptoms)
+    
+    @property
+    def throughput(self) -> float:
+        """Reports diagnosed per second since the engine was created"""
+        return self.reports / self.elapsed if self.elapsed else 0.0
+
+
+class IncrementalDiagnosis:
+    """Diagnosis that follows edits of a report without resetting working memory
+    
+    Keeps the sintoma fact asserted for each category. Changing a selection
+    retracts that fact and asserts its replacement; because the rules'
+    conditions are logical, CLIPS retracts the diagnostico and tratamiento
+    facts that lose all their support, and only the rules matching the edited
+    facts run, so the cost follows the size of the edit rather than of the
+    report. It needs an environment of its own, whose working memory is the
+    current report.
+    """
+    
+    def __init__(self, env=None):
+        self.env = env if env is not None else create_expert_system()
+        self.sintoma = self.env.find_template('sintoma')
+        self.env.reset()
+        # category -> (symptom, asserted fact)
+        self.facts = {}
+    
+    def select(self, category: str, symptom: str) -> DiagnosisResult:
+        """Change the symptom of one category ('' or None clears it)"""
+        return self.update({category: symptom})
+    
+    def update(self, symptoms: Dict[str, str]) -> DiagnosisResult:
+        """Apply the categories whose selection changed and return the resulting diagnosis"""
+        start = time.perf_counter()
+        edits = 0
+        retracting = asserting = 0.0
+        for category, symptom in symptoms.items():
+            symptom = symptom or None
+            current = self.facts.get(category)
+            if (current[0] if current is not None else None) == symptom:
+                continue
+            if current is not None:
+                phase_start = time.perf_counter()
+                current[1].retract()
+                del self.facts[category]
+                retracting += time.perf_counter() - phase_start
+            if symptom is not None:
+                phase_start = time.perf_counter()
+                self.facts[category] = (symptom, self.sintoma.assert_fact(categoria=category, caracteristica=symptom))
+                asserting += time.perf_counter() - phase_start
+            edits += 1
+        edits_done = time.perf_counter()
+        if edits:
+            self.env.run()
+        run_done = time.perf_counter()
+        result = self.result()
+        end = time.perf_counter()
+        
+        METRICS.observe('diagnosis_incremental_retract', retracting)
+        METRICS.observe('diagnosis_incremental_assert', asserting)
+        METRICS.observe('diagnosis_incremental_run', run_done - edits_done)
+        METRICS.observe('diagnosis_incremental_facts', end - run_done)
+        METRICS.observe('diagnosis_incremental', end - start)
+        METRICS.increment('diagnosis_incremental_edits', edits)
+        return result
+    
+    def result(self) -> DiagnosisResult:
+        """Diagnosis of the current selections"""
+        deficiencies = []
+        treatments = []
+        for fact in self.env.facts():
+            name = fact.template.name
+            if name == 'diagnostico':
+                deficiencies.append(fact['deficiencia'])
+            elif name == 'tratamiento':
+                treatments.append(fact['recomendacion'])
+        symptoms = tuple((category, symptom) for category, (symptom, _) in self.facts.items())
+        return DiagnosisResult(symptoms, tuple(deficiencies), tuple(treatments))
+    
+    def clear(self):
+        """Forget every selection"""
+        self.env.reset()
+        self.facts.clear()
+
+
+def check_incremental_equivalence(steps: int = 2000, seed: int = 0) -> List[Tuple]:
+    """Compare IncrementalDiagnosis with a from-scratch diagnosis along random edits
+    
+    Each step changes one category to a random option (or clears it);
+    returns the mismatching (selections, expected, result) triples.
+    """
+    rng = random.Random(seed)
+    engine = DiagnosisEngine()
+    incremental = IncrementalDiagnosis()
+    selections = dict.fromkeys(SYMPTOM_CATEGORIES, "")
+    mismatches = []
+    for _ in range(steps):
+        category = rng.choice(list(SYMPTOM_CATEGORIES))
+        selections[category] = rng.choice([""] + SYMPTOM_CATEGORIES[category])
+        result = incremental.select(category, selections[category])
+        expected = engine.diagnose(selections)
+        if (set(result.symptoms) != set(expected.symptoms) or set(result.deficiencies) != set(expected.deficiencies)
+                or set(result.treatments) != set(expected.treatments)):
+            mismatches.append((dict(selections), expected, result))
+    return mismatches
+
+
+class DiagnosisCache:
+    """LRU memoization of diagnoses in front of a DiagnosisEngine
+    
+    Results are keyed by the order-independent symptom set and tagged with the
+    hash of the engine's rule base, so the cache empties itself as soon as the
+    rules change. Each call only compares the hash the engine keeps, without
+    walking the rules, so changes must go through the engine (build,
+    undefine): after editing the environment directly, call
+    engine.refresh_rules_hash() or the cache keeps serving old results.
+    """
+    
+    def __init__(self, engine: DiagnosisEngine = None, maxsize: int = 1024):
+        self.engine = engine if engine is not None else DiagnosisEngine()
+        self.maxsize = maxsize
+        self.rules_hash = self.engine.rules_hash
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def key(symptoms: SymptomSet) -> Tuple[Tuple[str, str], ...]:
+        """Canonical, order-independent form of a symptom set"""
+        return tuple(sorted(set(normalize_symptoms(symptoms))))
+    
+    def diagnose(self, symptoms: SymptomSet) -> DiagnosisResult:
+        """Diagnose a single symptom set, reusing a cached result when possible"""
+        if self.engine.rules_hash != self.rules_hash:
+            self.clear()
+            self.rules_hash = self.engine.rules_hash
+        
+        selected = normalize_symptoms(symptoms)
+        key = self.key(selected)
+        result = self._results.get(key)
+        if result is not None:
+            self.hits += 1
+            METRICS.increment('diagnosis_cache_hit')
+            self._results.move_to_end(key)
+            return result._replace(symptoms=selected)
+        
+        self.misses += 1
+        METRICS.increment('diagnosis_cache_miss')
+        result = self.engine.diagnose(selected)
+        self._results[key] = result
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+        return result
+    
+    def diagnose_many(self, symptom_sets: Iterable[SymptomSet]) -> Iterator[DiagnosisResult]:
+        """Diagnose every symptom set, yielding results in input order"""
+        for symptoms in symptom_sets:
+            yield self.diagnose(symptoms)
+    
+    def clear(self):
+        """Drop every cached result"""
+        self._results.clear()
+    
+    def info(self) -> Dict[str, int]:
+        """Hit/miss counters and current size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._results),
+            'maxsize': self.maxsize
+        }
+
+
+def diagnose_many(symptom_sets: Iterable[SymptomSet], engine: DiagnosisEngine = None) -> List[DiagnosisResult]:
+    """Diagnose a batch of symptom sets without the GUI
+    
+    Pass an existing engine to keep reusing its warm environment (and to read
+    its throughput afterwards); otherwise a new one is created for the batch.
+    """
+    if engine is None:
+        engine = DiagnosisEngine()
+    return list(engine.diagnose_many(symptom_sets))
+
+
+# Diagnosis engine of the current pool worker process
+_worker_engine = None
+
+
+def map_chunks(executor, function, items: Iterable, chunksize: int, max_pending: int) -> Iterator:
+    """Apply function to chunks of items on an executor, yielding its results in input order
+    
+    function takes a list of up to chunksize items and returns a list of
+    results. At most max_pending chunks are in flight, so arbitrarily long
+    inputs are streamed instead of being queued all at once.
+    """
+    pending = deque()
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunksize))
+        if not chunk:
+            break
+        pending.append(executor.submit(function, chunk))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def _init_pool_worker(cache_size: int):
+    """Build the worker's own CLIPS environment once, when the process starts"""
+    global _worker_engine
+    _worker_engine = DiagnosisEngine(create_expert_system(snapshot=True))
+    if cache_size:
+        _worker_engine = DiagnosisCache(_worker_engine, maxsize=cache_size)
+
+
+def _diagnose_chunk(chunk: List[Tuple[Tuple[str, str], ...]]) -> List[DiagnosisResult]:
+    """Diagnose one shard of symptom sets in a pool worker"""
+    return [_worker_engine.diagnose(symptoms) for symptoms in chunk]
+
+
+class DiagnosisPool:
+    """Parallel diagnosis over a pool of worker processes
+    
+    A CLIPS environment cannot be shared between processes, so every worker
+    builds its own with create_expert_system() and keeps it for its lifetime.
+    Symptom sets are sent in chunks of chunksize and results come back in
+    submission order; at most max_pending chunks are in flight, so arbitrarily
+    long inputs are streamed instead of being queued all at once.
+    """
+    
+    def __init__(self, workers: int = None, chunksize: int = 256, cache_size: int = 0, max_pending: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.max_pending = max_pending or 2 * self.workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_pool_worker,
+            initargs=(cache_size,)
+        )
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """Shut the worker processes down"""
+        self.executor.shutdown()
+    
+    def diagnose_many(self, symptom_sets: Iterable[SymptomSet]) -> Iterator[DiagnosisResult]:
+        """Diagnose every symptom set across the workers, yielding results in input order"""
+        yield from map_chunks(self.executor, _diagnose_chunk, map(normalize_symptoms, symptom_sets),
+                              self.chunksize, self.max_pending)
+
+
+def all_symptom_sets() -> List[Dict[str, str]]:
+    """Every combination of one optional symptom per category"""
+    options = [[""] + symptoms for symptoms in SYMPTOM_CATEGORIES.values()]
+    return [dict(zip(SYMPTOM_CATEGORIES, combination)) for combination in product(*options)]
+
+
+def benchmark_pool_scaling(reports: int = 20000, worker_counts: List[int] = None,
+                           chunksize: int = 256) -> List[Dict[str, float]]:
+    """Measure DiagnosisPool throughput (reports/sec) for increasing worker counts
+    
+    Worker start-up is excluded: each pool is warmed with one chunk per worker
+    before the timed run.
+    """
+    combinations = all_symptom_sets()
+    symptom_sets = [combinations[i % len(combinations)] for i in range(reports)]
+    worker_counts = worker_counts or list(range(1, (os.cpu_count() or 1) + 1))
+    
+    results = []
+    for workers in worker_counts:
+        with DiagnosisPool(workers=workers, chunksize=chunksize) as pool:
+            for _ in pool.diagnose_many(symptom_sets[:workers * chunksize]):
+                pass
+            start = time.perf_counter()
+            for _ in pool.diagnose_many(symptom_sets):
+                pass
+            elapsed = time.perf_counter() - start
+        throughput = reports / elapsed
+        results.append({
+            'workers': workers,
+            'seconds': elapsed,
+            'throughput': throughput,
+            'speedup': throughput / results[0]['throughput'] if results else 1.0
+        })
+    return results
+
+
+class FuzzySystem(NamedTuple):
+    """Antecedents, consequent and compiled control system of the plant recommender"""
+    acidez: ctrl.Antecedent
+    riego: ctrl.Antecedent
+    planta: ctrl.Consequent
+    control: ctrl.ControlSystem
+
+
+# Trapezoids (trapmf parameters) of the fuzzy sets
+ACIDEZ_SETS = {
+    'ácido': [0, 0, 4.5, 6.5],
+    'neutro': [4.5, 6.5, 8, 10],
+    'alcalino': [8, 10, 14, 14]
+}
+RIEGO_SETS = {
+    'bajo': [0, 0, 3, 4.5],
+    'medio': [3, 4.5, 6, 7],
+    'alto': [6, 7, 10, 10]
+}
+PLANTA_SETS = {
+    'cactus': [0, 0, 0.7, 1.5],
+    'rosal': [1, 1.5, 2.2, 3.3],
+    'helecho': [2.5, 3.3, 4, 4.5]
+}
+
+# Fuzzy rules as (acidez, riego) -> planta
+FUZZY_RULES = [
+    ('ácido', 'alto', 'helecho'),
+    ('ácido', 'medio', 'helecho'),
+    ('ácido', 'bajo', 'rosal'),
+    ('neutro', 'alto', 'helecho'),
+    ('neutro', 'medio', 'rosal'),
+    ('neutro', 'bajo', 'rosal'),
+    ('alcalino', 'alto', 'helecho'),
+    ('alcalino', 'medio', 'rosal'),
+    ('alcalino', 'bajo', 'cactus')
+]
+
+
+def create_fuzzy_system() -> FuzzySystem:
+    """Create the fuzzy logic system for plant recommendation"""
+    # Definición de los antecedentes (entradas)
+    acidez = ctrl.Antecedent(np.arange(0, 14, 0.1), 'acidez')  # pH del suelo
+    riego = ctrl.Antecedent(np.arange(0, 10, 0.1), 'riego')  # Frecuencia de riego
+
+    # Definición del consecuente (salida)
+    planta = ctrl.Consequent(np.arange(0, 5, 0.1), 'planta')  # Tipo de planta
+
+    # Definir conjuntos difusos
+    for term, params in ACIDEZ_SETS.items():
+        acidez[term] = fuzz.trapmf(acidez.universe, params)
+    for term, params in RIEGO_SETS.items():
+        riego[term] = fuzz.trapmf(riego.universe, params)
+    for term, params in PLANTA_SETS.items():
+        planta[term] = fuzz.trapmf(planta.universe, params)
+
+    # # Definir reglas difusas
+    # rule1 = ctrl.Rule(acidez['ácido'] & riego['alto'], planta['helecho'])
+    # rule2 = ctrl.Rule(acidez['neutro'] & riego['medio'], planta['rosal'])
+    # rule3 = ctrl.Rule(acidez['alcalino'] & riego['bajo'], planta['cactus'])
+
+    # # Crear el sistema de control
+    # planta_ctrl = ctrl.ControlSystem([rule1, rule2, rule3])
+    # self.sistema = ctrl.ControlSystemSimulation(planta_ctrl)
+
+    # Definir reglas
+    rules = [
+        ctrl.Rule(acidez[acidez_term] & riego[riego_term], planta[planta_term])
+        for acidez_term, riego_term, planta_term in FUZZY_RULES
+    ]
+
+    # Crear sistema de control
+    planta_ctrl = ctrl.ControlSystem(rules)
+    return FuzzySystem(acidez, riego, planta, planta_ctrl)
+
+
+def clipped_memberships(planta: ctrl.Consequent, cuts: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """Output sets sampled on their universe and clipped at their activation"""
+    return {term_name: np.minimum(cuts[term_name], term.mf) for term_name, term in planta.terms.items()}
+
+
+class RecommendationPlot:
+    """Membership curves of the output with the current result, updated in place
+    
+    The curves are drawn once; update() only swaps the clipped output fills and
+    moves the result line. The figure is a plain matplotlib Figure, not tracked
+    by pyplot, so it never leaks and can be put on a Tk canvas or rendered
+    headless with Agg.
+    """
+    
+    def __init__(self, planta: ctrl.Consequent, figsize: Tuple[float, float] = (6, 4)):
+        from matplotlib.figure import Figure
+        self.planta = planta
+        self.figure = Figure(figsize=figsize)
+        self.ax = self.figure.add_subplot()
+        self.term_colors = {}
+        for term_name, term in planta.terms.items():
+            line, = self.ax.plot(planta.universe, term.mf, label=term_name, linewidth=1)
+            self.term_colors[term_name] = line.get_color()
+        self.ax.set_ylim([0, 1.01])
+        self.ax.set_xlim([planta.universe.min(), planta.universe.max()])
+        self.ax.set_xlabel(planta.label)
+        self.ax.set_ylabel('Membership')
+        self.ax.spines['top'].set_visible(False)
+        self.ax.spines['right'].set_visible(False)
+        self.ax.legend(framealpha=0.5)
+        
+        # Artists updated on every result
+        self.output_fills = []
+        self.result_line = self.ax.axvline(x=0, color='black', linestyle='-', linewidth=2, visible=False)
+    
+    def update(self, resultado: float, cuts: Dict[str, float]):
+        """Show a new result and its output activations"""
+        for fill in self.output_fills:
+            fill.remove()
+        self.output_fills = [
+            self.ax.fill_between(self.planta.universe, 0, clipped, facecolor=self.term_colors[term_name], alpha=0.4)
+            for term_name, clipped in clipped_memberships(self.planta, cuts).items()
+        ]
+        self.result_line.set_xdata([resultado, resultado])
+        self.result_line.set_visible(True)
+
+
+# Plant types by crisp output, with their descriptions
+PLANT_DESCRIPTIONS = {
+    "Cactus": "Los cactus son ideales para suelos alcalinos con baja frecuencia de riego.",
+    "Rosal": "Los rosales prefieren suelos neutros con frecuencia de riego media.",
+    "Helecho": "Los helechos prosperan en suelos ácidos con alta frecuencia de riego."
+}
+
+
+def recommend_plant(resultado: float) -> str:
+    """Determine the plant type based on the crisp fuzzy output"""
+    if resultado < 1.5:
+        return "Cactus"
+    elif resultado < 3:
+        return "Rosal"
+    return "Helecho"
+
+
+def validate_inputs(ph_value: float, riego_value: float):
+    """Raise ValueError if pH or watering frequency are out of range"""
+    if not (0 <= ph_value <= 14):
+        raise ValueError("El valor de pH debe estar entre 0 y 14.")
+    if not (0 <= riego_value <= 10):
+        raise ValueError("La frecuencia de riego debe estar entre 0 y 10.")
+
+
+class RecommendationSurface:
+    """Precomputed pH x riego grid of the fuzzy output, queried by bilinear interpolation
+    
+    The control system is sampled once over the whole input domain (in a single
+    vectorized compute()) and every query afterwards is a constant-time lookup.
+    
+    Error bound: the output is piecewise smooth with kinks along the trapezoid
+    breakpoints, so the interpolation error is O(step) next to a breakpoint and
+    O(step**2) elsewhere. Measured with max_error() against the exact path over
+    the default system: step 0.1 -> max 0.03, step 0.25 -> max 0.085, step
+    0.5 -> max 0.16 (on a 0-5 output scale), so the recommended plant can only
+    differ from the exact path within that distance of the 1.5 and 3 thresholds.
+    """
+    
+    def __init__(self, control: ctrl.ControlSystem, ph_step: float = 0.1, riego_step: float = 0.1):
+        self.control = control
+        self.ph_points = int(round(14 / ph_step)) + 1
+        self.riego_points = int(round(10 / riego_step)) + 1
+        self.ph_step = 14 / (self.ph_points - 1)
+        self.riego_step = 10 / (self.riego_points - 1)
+        
+        # Sample the exact output over the grid
+        ph_grid, riego_grid = np.meshgrid(
+            np.linspace(0, 14, self.ph_points),
+            np.linspace(0, 10, self.riego_points),
+            indexing='ij'
+        )
+        self.values = self.exact(ph_grid.ravel(), riego_grid.ravel()).reshape(ph_grid.shape)
+        
+        # Plain lists are faster than numpy indexing for scalar lookups
+        self._rows = self.values.tolist()
+    
+    def exact(self, ph_values, riego_values) -> np.ndarray:
+        """Compute the fuzzy output through skfuzzy for arrays of inputs"""
+        sim = ctrl.ControlSystemSimulation(self.control, cache=False)
+        sim.input['acidez'] = np.asarray(ph_values, dtype=float)
+        sim.input['riego'] = np.asarray(riego_values, dtype=float)
+        sim.compute()
+        return np.asarray(sim.output['planta'], dtype=float)
+    
+    def __call__(self, ph_value: float, riego_value: float) -> float:
+        """Interpolate the fuzzy output for a single (pH, riego) pair"""
+        x = ph_value / self.ph_step
+        y = riego_value / self.riego_step
+        i = min(int(x), self.ph_points - 2)
+        j = min(int(y), self.riego_points - 2)
+        dx = x - i
+        dy = y - j
+        row0 = self._rows[i]
+        row1 = self._rows[i + 1]
+        return ((row0[j] * (1 - dy) + row0[j + 1] * dy) * (1 - dx)
+                + (row1[j] * (1 - dy) + row1[j + 1] * dy) * dx)
+    
+    def lookup_many(self, ph_values, riego_values) -> np.ndarray:
+        """Interpolate the fuzzy output for arrays of inputs"""
+        x = np.asarray(ph_values, dtype=float) / self.ph_step
+        y = np.asarray(riego_values, dtype=float) / self.riego_step
+        i = np.clip(x.astype(int), 0, self.ph_points - 2)
+        j = np.clip(y.astype(int), 0, self.riego_points - 2)
+        dx = x - i
+        dy = y - j
+        v = self.values
+        return ((v[i, j] * (1 - dy) + v[i, j + 1] * dy) * (1 - dx)
+                + (v[i + 1, j] * (1 - dy) + v[i + 1, j + 1] * dy) * dx)
+    
+    def max_error(self, samples: int = 5000, seed: int = 0) -> float:
+        """Largest absolute difference against the exact path over random inputs"""
+        rng = np.random.default_rng(seed)
+        ph_values = rng.uniform(0, 14, samples)
+        riego_values = rng.uniform(0, 10, samples)
+        return float(np.max(np.abs(self.lookup_many(ph_values, riego_values) - self.exact(ph_values, riego_values))))
+
+
+def _monotone_runs(mf: np.ndarray) -> List[Tuple[int, int]]:
+    """Split a sampled membership function into maximal strictly monotone runs"""
+    runs = []
+    signs = np.sign(np.diff(mf))
+    start = None
+    for i, sign in enumerate(signs):
+        if start is not None and sign != signs[start]:
+            runs.append((start, i))
+            start = None
+        if start is None and sign != 0:
+            start = i
+    if start is not None:
+        runs.append((start, len(signs)))
+    return runs
+
+
+def _frozen(values) -> np.ndarray:
+    """Read-only copy of an array, safe to share between threads"""
+    array = np.array(values)
+    array.setflags(write=False)
+    return array
+
+
+class VectorizedFuzzyEngine:
+    """NumPy batch evaluation of the fuzzy recommender over arrays of (pH, riego)
+    
+    Reproduces skfuzzy's inference for the same sampled sets and rule table:
+    interpolated antecedent memberships, min for AND, max to accumulate rules
+    per output term, and centroid over the consequent universe upsampled at
+    the cut points, so results match sistema.output['planta'] to float
+    precision. Inputs are processed in chunks of chunk_size rows, so peak
+    working memory stays around chunk_size * 2.5 KiB (about 80 MB with the
+    default) whatever the input length.
+    
+    After construction the engine only holds read-only arrays and every call
+    works on its own temporaries, so one instance can serve any number of
+    threads without locks (see FuzzyEvaluation and shared_fuzzy_model()).
+    """
+    
+    def __init__(self, fuzzy_system: FuzzySystem = None, rules: List[Tuple[str, str, str]] = None,
+                 chunk_size: int = 32768):
+        fuzzy_system = fuzzy_system if fuzzy_system is not None else create_fuzzy_system()
+        rules = rules if rules is not None else FUZZY_RULES
+        self.chunk_size = chunk_size
+        
+        acidez, riego, planta = fuzzy_system.acidez, fuzzy_system.riego, fuzzy_system.planta
+        self.acidez_universe = _frozen(acidez.universe)
+        self.riego_universe = _frozen(riego.universe)
+        self.planta_universe = _frozen(planta.universe)
+        self.acidez_terms = tuple(acidez.terms)
+        self.riego_terms = tuple(riego.terms)
+        self.planta_terms = tuple(planta.terms)
+        self.acidez_mfs = tuple(_frozen(acidez[term].mf) for term in self.acidez_terms)
+        self.riego_mfs = tuple(_frozen(riego[term].mf) for term in self.riego_terms)
+        self.planta_mfs = tuple(_frozen(planta[term].mf) for term in self.planta_terms)
+        
+        # Rule table as term indices
+        self.rule_acidez = _frozen([self.acidez_terms.index(a) for a, _, _ in rules])
+        self.rule_riego = _frozen([self.riego_terms.index(r) for _, r, _ in rules])
+        self.rule_planta = _frozen([self.planta_terms.index(p) for _, _, p in rules])
+        
+        # Monotone edges of each output set, where a cut level crosses the set
+        self.planta_edges = []
+        for term, mf in enumerate(self.planta_mfs):
+            for start, end in _monotone_runs(mf):
+                x = self.planta_universe[start:end + 1]
+                y = mf[start:end + 1]
+                if y[-1] < y[0]:
+                    x, y = x[::-1], y[::-1]
+                self.planta_edges.append((term, _frozen(y), _frozen(x)))
+        self.planta_edges = tuple(self.planta_edges)
+    
+    def memberships(self, ph_values, riego_values) -> Tuple[np.ndarray, np.ndarray]:
+        """Membership matrices of shape (N, terms) for acidez and riego"""
+        mu_acidez = np.column_stack([np.interp(ph_values, self.acidez_universe, mf) for mf in self.acidez_mfs])
+        mu_riego = np.column_stack([np.interp(riego_values, self.riego_universe, mf) for mf in self.riego_mfs])
+        return mu_acidez, mu_riego
+    
+    def activations(self, ph_values, riego_values) -> np.ndarray:
+        """Activation of each output term, shape (N, planta terms)"""
+        mu_acidez, mu_riego = self.memberships(ph_values, riego_values)
+        firing = np.minimum(mu_acidez[:, self.rule_acidez], mu_riego[:, self.rule_riego])
+        cuts = np.zeros((firing.shape[0], len(self.planta_terms)))
+        for rule, term in enumerate(self.rule_planta):
+            np.maximum(cuts[:, term], firing[:, rule], out=cuts[:, term])
+        return cuts
+    
+    def defuzzify(self, cuts: np.ndarray) -> np.ndarray:
+        """Centroid of the aggregated output for each row of term activations"""
+        n = cuts.shape[0]
+        
+        # Upsample the universe at the points where each cut crosses its set
+        crossings = [np.interp(cuts[:, term], y, x) for term, y, x in self.planta_edges]
+        universe = np.hstack([np.broadcast_to(self.planta_universe, (n, len(self.planta_universe))),
+                              np.column_stack(crossings)])
+        universe.sort(axis=1)
+        
+        # Aggregate the clipped sets
+        aggregated = np.zeros_like(universe)
+        for term, mf in enumerate(self.planta_mfs):
+            np.maximum(aggregated, np.minimum(cuts[:, term:term + 1], np.interp(universe, self.planta_universe, mf)),
+                       out=aggregated)
+        
+        # Exact area and first moment of the piecewise linear output
+        x1, y1, y2 = universe[:, :-1], aggregated[:, :-1], aggregated[:, 1:]
+        dx = np.diff(universe, axis=1)
+        area = np.sum(0.5 * dx * (y1 + y2), axis=1)
+        moment = np.sum(dx * (0.5 * x1 * (y1 + y2) + dx * (y1 + 2 * y2) / 6), axis=1)
+        return moment / np.fmax(area, np.finfo(float).eps)
+    
+    def compute_chunk(self, ph_values, riego_values) -> np.ndarray:
+        """Crisp outputs for one chunk of inputs, without splitting"""
+        ph_values = np.asarray(ph_values, dtype=float)
+        riego_values = np.asarray(riego_values, dtype=float)
+        return self.defuzzify(self.activations(ph_values, riego_values))
+    
+    def iter_compute(self, ph_values, riego_values, chunk_size: int = None) -> Iterator[np.ndarray]:
+        """Yield crisp outputs chunk by chunk, for streaming very large inputs"""
+        chunk_size = chunk_size or self.chunk_size
+        for start in range(0, len(ph_values), chunk_size):
+            yield self.compute_chunk(ph_values[start:start + chunk_size], riego_values[start:start + chunk_size])
+    
+    def compute(self, ph_values, riego_values, chunk_size: int = None, out: np.ndarray = None) -> np.ndarray:
+        """Crisp outputs for arrays of inputs, evaluated chunk by chunk
+        
+        Pass out (for instance a np.memmap) to avoid allocating the result array.
+        """
+        ph_values = np.ravel(ph_values)
+        riego_values = np.ravel(riego_values)
+        if len(ph_values) != len(riego_values):
+            raise ValueError("pH y riego deben tener la misma longitud.")
+        if out is None:
+            out = np.empty(len(ph_values))
+        chunk_size = chunk_size or self.chunk_size
+        start = 0
+        for chunk in self.iter_compute(ph_values, riego_values, chunk_size):
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return out
+
+
+class FuzzyEvaluation:
+    """Per-call state of a recommendation over a shared VectorizedFuzzyEngine
+    
+    Offers the input/output interface of ControlSystemSimulation, but only
+    owns two dicts and the cut levels of the last compute(); the universes,
+    membership functions and rule table stay in the shared engine. Creating
+    one per request (or per thread) replaces a whole simulation per caller.
+    """
+    
+    __slots__ = ('model', 'input', 'output', 'cuts')
+    
+    def __init__(self, model: VectorizedFuzzyEngine = None):
+        self.model = model if model is not None else shared_fuzzy_model()
+        self.input = {}
+        self.output = {}
+        self.cuts = None
+    
+    def compute(self):
+        """Evaluate the current inputs into output['planta'] and cuts"""
+        cuts = self.model.activations(np.array([float(self.input['acidez'])]), np.array([float(self.input['riego'])]))
+        if not cuts.any():
+            raise ValueError("Ninguna regla difusa se activó para estas entradas.")
+        self.cuts = dict(zip(self.model.planta_terms, cuts[0].tolist()))
+        self.output['planta'] = float(self.model.defuzzify(cuts)[0])
+
+
+_shared_model_lock = threading.Lock()
+_shared_model = None
+
+
+def shared_fuzzy_model() -> VectorizedFuzzyEngine:
+    """The process-wide read-only fuzzy model, built on first use"""
+    global _shared_model
+    if _shared_model is None:
+        with _shared_model_lock:
+            if _shared_model is None:
+                _shared_model = VectorizedFuzzyEngine()
+    return _shared_model
+
+
+def evaluate_recommendation(ph_value: float, riego_value: float,
+                            model: VectorizedFuzzyEngine = None) -> Tuple[float, Dict[str, float]]:
+    """Crisp value and output activations on a FuzzyEvaluation of its own, so safe on any thread"""
+    evaluation = FuzzyEvaluation(model)
+    evaluation.input['acidez'] = ph_value
+    evaluation.input['riego'] = riego_value
+    evaluation.compute()
+    return evaluation.output['planta'], evaluation.cuts
+
+
+def trapezoid(x: float, params) -> float:
+    """Exact trapmf membership of a single value, without a universe array"""
+    a, b, c, d = params
+    if b <= x <= c:
+        return 1.0
+    if a < x < b:
+        return (x - a) / (b - a)
+    if c < x < d:
+        return (d - x) / (d - c)
+    return 0.0
+
+
+class AnalyticFuzzyEngine:
+    """Closed-form fuzzy inference for trapezoidal sets
+    
+    Memberships are evaluated on the trapezoids themselves and the centroid is
+    integrated exactly: the aggregated output is piecewise linear, with kinks
+    only at the trapezoid corners, where an edge meets a cut level and where
+    two edges cross, so the area and first moment are sums over those pieces.
+    Unlike the skfuzzy path it does not depend on any grid step and covers the
+    whole input domain, including pH 14 and riego 10.
+    """
+    
+    def __init__(self, acidez_sets: Dict[str, List[float]] = None, riego_sets: Dict[str, List[float]] = None,
+                 planta_sets: Dict[str, List[float]] = None, rules: List[Tuple[str, str, str]] = None):
+        self.acidez_sets = acidez_sets if acidez_sets is not None else ACIDEZ_SETS
+        self.riego_sets = riego_sets if riego_sets is not None else RIEGO_SETS
+        self.planta_sets = planta_sets if planta_sets is not None else PLANTA_SETS
+        self.rules = rules if rules is not None else FUZZY_RULES
+        
+        # Edges of the output sets as lines y = slope * x + intercept, with their x range
+        self.edges = []
+        for a, b, c, d in self.planta_sets.values():
+            if b > a:
+                self.edges.append((1 / (b - a), -a / (b - a), a, b))
+            if d > c:
+                self.edges.append((-1 / (d - c), d / (d - c), c, d))
+        
+        # Kinks that do not depend on the cut levels: corners and edge crossings
+        points = {x for params in self.planta_sets.values() for x in params}
+        for i, (m1, q1, lo1, hi1) in enumerate(self.edges):
+            for m2, q2, lo2, hi2 in self.edges[i + 1:]:
+                if m1 != m2:
+                    x = (q2 - q1) / (m1 - m2)
+                    if max(lo1, lo2) < x < min(hi1, hi2):
+                        points.add(x)
+        self.static_points = points
+    
+    def activations(self, ph_value: float, riego_value: float) -> Dict[str, float]:
+        """Cut level of each output set"""
+        mu_acidez = {term: trapezoid(ph_value, params) for term, params in self.acidez_sets.items()}
+        mu_riego = {term: trapezoid(riego_value, params) for term, params in self.riego_sets.items()}
+        cuts = dict.fromkeys(self.planta_sets, 0.0)
+        for acidez_term, riego_term, planta_term in self.rules:
+            firing = min(mu_acidez[acidez_term], mu_riego[riego_term])
+            if firing > cuts[planta_term]:
+                cuts[planta_term] = firing
+        return cuts
+    
+    def aggregated(self, x: float, cuts: Dict[str, float]) -> float:
+        """Value of the aggregated (clipped and max-combined) output at x"""
+        return max(min(cuts[term], trapezoid(x, params)) for term, params in self.planta_sets.items())
+    
+    def centroid(self, cuts: Dict[str, float]) -> float:
+        """Exact centroid of the aggregated output"""
+        points = set(self.static_points)
+        for level in cuts.values():
+            if level > 0:
+                for slope, intercept, lo, hi in self.edges:
+                    points.add((level - intercept) / slope)
+        points = sorted(points)
+        
+        area = 0.0
+        moment = 0.0
+        x1 = points[0]
+        y1 = self.aggregated(x1, cuts)
+        for x2 in points[1:]:
+            y2 = self.aggregated(x2, cuts)
+            dx = x2 - x1
+            area += 0.5 * dx * (y1 + y2)
+            moment += dx * (0.5 * x1 * (y1 + y2) + dx * (y1 + 2 * y2) / 6)
+            x1, y1 = x2, y2
+        if area == 0:
+            raise ValueError("Ninguna regla difusa se activó para estas entradas.")
+        return moment / area
+    
+    def compute(self, ph_value: float, riego_value: float) -> float:
+        """Crisp fuzzy output for a single (pH, riego) pair"""
+        return self.centroid(self.activations(ph_value, riego_value))
+
+
+class Recommendation(NamedTuple):
+    """Structured result of a single plant recommendation"""
+    ph: float
+    riego: float
+    value: float
+    plant: str
+
+
+class RecommendationEngine:
+    """Headless plant recommendation
+    
+    mode='exact' evaluates skfuzzy's model (same values as its compute(), as
+    the GUI uses) through a FuzzyEvaluation over the shared read-only model;
+    mode='surface' answers from a RecommendationSurface built on first use;
+    mode='analytic' integrates the trapezoids in closed form (AnalyticFuzzyEngine).
+    
+    Exact and analytic modes keep no per-call state in the engine, so one
+    instance can be used from many threads at once.
+    """
+    
+    MODES = ('exact', 'surface', 'analytic')
+    
+    def __init__(self, fuzzy_system: FuzzySystem = None, mode: str = 'exact',
+                 ph_step: float = 0.1, riego_step: float = 0.1):
+        if mode not in self.MODES:
+            raise ValueError(f"Modo desconocido: {mode}")
+        self.mode = mode
+        self.ph_step = ph_step
+        self.riego_step = riego_step
+        self.analytic = AnalyticFuzzyEngine()
+        self._fuzzy_system = fuzzy_system
+        self._surface = None
+        self._vectorized = None
+    
+    @property
+    def fuzzy_system(self) -> FuzzySystem:
+        """The skfuzzy model, only built (and skfuzzy only imported) when a mode needs it"""
+        if self._fuzzy_system is None:
+            self._fuzzy_system = create_fuzzy_system()
+        return self._fuzzy_system
+    
+    @property
+    def surface(self) -> RecommendationSurface:
+        """The interpolation surface, built once on first access"""
+        if self._surface is None:
+            self._surface = RecommendationSurface(self.fuzzy_system.control, self.ph_step, self.riego_step)
+        return self._surface
+    
+    @property
+    def vectorized(self) -> VectorizedFuzzyEngine:
+        """The NumPy engine, shared by the whole process unless a custom fuzzy system was given"""
+        if self._vectorized is None:
+            if self._fuzzy_system is None:
+                self._vectorized = shared_fuzzy_model()
+            else:
+                self._vectorized = VectorizedFuzzyEngine(self._fuzzy_system)
+        return self._vectorized
+    
+    def compute(self, ph_value: float, riego_value: float) -> float:
+        """Crisp fuzzy output for a single (pH, riego) pair"""
+        validate_inputs(ph_value, riego_value)
+        start = time.perf_counter()
+        if self.mode == 'surface':
+            resultado = self.surface(ph_value, riego_value)
+        elif self.mode == 'analytic':
+            resultado = self.analytic.compute(ph_value, riego_value)
+        else:
+            evaluation = FuzzyEvaluation(self.vectorized)
+            evaluation.input['acidez'] = ph_value
+            evaluation.input['riego'] = riego_value
+            evaluation.compute()
+            resultado = evaluation.output['planta']
+        METRICS.observe(f'fuzzy_{self.mode}', time.perf_counter() - start)
+        return resultado
+    
+    def recommend(self, ph_value: float, riego_value: float) -> Recommendation:
+        """Recommend a plant for a single (pH, riego) pair"""
+        resultado = self.compute(ph_value, riego_value)
+        return Recommendation(ph_value, riego_value, resultado, recommend_plant(resultado))
+    
+    def compute_many(self, ph_values, riego_values) -> np.ndarray:
+        """Crisp fuzzy outputs for arrays of inputs, already validated
+        
+        In exact mode the batch goes through VectorizedFuzzyEngine, which gives
+        the same values as skfuzzy's compute().
+        """
+        if self.mode == 'surface':
+            return self.surface.lookup_many(ph_values, riego_values)
+        if self.mode == 'analytic':
+            return np.array([self.analytic.compute(p, r) for p, r in zip(ph_values, riego_values)])
+        return self.vectorized.compute(ph_values, riego_values)
+
+
+# Plant names in the order of the crisp output, and the values separating them
+PLANT_NAMES = ("Cactus", "Rosal", "Helecho")
+PLANT_THRESHOLDS = (1.5, 3.0)
+
+
+# Fields of a field record besides the symptom categories
+RECORD_PH = 'ph'
+RECORD_RIEGO = 'riego'
+
+# Field with the plot identifier in sensor readings and site tables
+RECORD_PLOT = 'parcela'
+
+
+def parse_number(value):
+    """Parse a numeric record field, treating empty values as missing"""
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def parse_inputs(ph_value, riego_value) -> Tuple[float, float]:
+    """pH and riego from raw record fields; raises ValueError (or TypeError) if either is missing or invalid"""
+    ph_value = parse_number(ph_value)
+    riego_value = parse_number(riego_value)
+    if ph_value is None or riego_value is None:
+        raise ValueError("Faltan ph o riego.")
+    validate_inputs(ph_value, riego_value)
+    return ph_value, riego_value
+
+
+@contextlib.contextmanager
+def open_records(input_path: str = '-', output_path: str = '-'):
+    """Source and target file objects of a headless run, '-' meaning stdin and stdout
+    
+    Files opened here are closed on exit; stdin and stdout stay open.
+    """
+    with contextlib.ExitStack() as stack:
+        source = sys.stdin if input_path == '-' else stack.enter_context(
+            open(input_path, newline='', encoding='utf-8'))
+        target = sys.stdout if output_path == '-' else stack.enter_context(
+            open(output_path, 'w', newline='', encoding='utf-8'))
+        yield source, target
+
+
+def read_records(stream, fmt: str = 'jsonl') -> Iterator[Dict]:
+    """Stream field records from a CSV or JSONL file object
+    
+    A record has one field per symptom category (the selected symptom, or
+    empty), plus 'ph' and 'riego'; any other field (an id, for example) is
+    passed through to the output.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def process_records(records: Iterable[Dict], batch_size: int = 1000, diagnosis: DiagnosisCache = None,
+                    recommendation: RecommendationEngine = None, ranking=None, top_k: int = 3) -> Iterator[Dict]:
+    """Diagnose and recommend for a stream of field records, batch by batch
+    
+    Only one batch is held in memory at a time, so the stream can be
+    arbitrarily long; the fuzzy outputs of a batch are computed in one
+    vectorized call. With a ranking (a diferencialPlantas.DifferentialDiagnosis),
+    each result also gets the top_k deficiencies by confidence, scored for
+    the whole batch at once.
+    
+    A bad field only affects its own record: a symptom that is not text
+    leaves deficiencias, tratamientos and ranking as None, and a missing or
+    bad pH or riego leaves valor and planta as None, with the reasons in
+    'error'.
+    """
+    diagnosis = diagnosis if diagnosis is not None else DiagnosisCache()
+    recommendation = recommendation if recommendation is not None else RecommendationEngine()
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        
+        results = []
+        diagnosed_rows = []
+        symptom_sets = []
+        valid = []
+        for record in batch:
+            result = dict(record)
+            errors = []
+            symptoms = {category: record.get(category) for category in SYMPTOM_CATEGORIES}
+            try:
+                validate_symptoms(symptoms)
+            except ValueError as e:
+                errors.append(str(e))
+                result['deficiencias'] = None
+                result['tratamientos'] = None
+            else:
+                diagnosed = diagnosis.diagnose(symptoms)
+                result['deficiencias'] = list(diagnosed.deficiencies)
+                result['tratamientos'] = list(diagnosed.treatments)
+                diagnosed_rows.append(len(results))
+                symptom_sets.append(symptoms)
+            result['valor'] = None
+            result['planta'] = None
+            try:
+                ph_value, riego_value = parse_inputs(record.get(RECORD_PH), record.get(RECORD_RIEGO))
+                valid.append((len(results), ph_value, riego_value))
+            except (TypeError, ValueError) as e:
+                errors.append(str(e))
+            if errors:
+                result['error'] = ' '.join(errors)
+            results.append(result)
+        
+        if ranking is not None:
+            for result in results:
+                result['ranking'] = None
+            for index, entries in zip(diagnosed_rows, ranking.rank_many(symptom_sets, top_k)):
+                results[index]['ranking'] = [entry._asdict() for entry in entries]
+        
+        if valid:
+            indices, ph_values, riego_values = zip(*valid)
+            values = recommendation.compute_many(np.array(ph_values), np.array(riego_values))
+            for index, value in zip(indices, values):
+                results[index]['valor'] = round(float(value), 6)
+                results[index]['planta'] = recommend_plant(value)
+        
+        yield from results
+
+
+def _csv_cell(value):
+    """CSV form of a result field: lists joined with '; ', ranked entries (dicts) as 'name (degree)'"""
+    if not isinstance(value, list):
+        return value
+    cells = []
+    for item in value:
+        if isinstance(item, dict):
+            name, degree = list(item.values())[:2]
+            cells.append(f"{name} ({degree:.2f})")
+        else:
+            cells.append(str(item))
+    return '; '.join(cells)
+
+
+def write_records(results: Iterable[Dict], stream, fmt: str = 'jsonl', flush_every: int = 1000):
+    """Write results incrementally as JSONL or CSV
+    
+    CSV columns are the fields of the first result plus error; list fields
+    such as deficiencias, ranking or sugerencias go into one cell each.
+    """
+    writer = None
+    for count, result in enumerate(results, 1):
+        if fmt == 'csv':
+            if writer is None:
+                fieldnames = list(result) + ([] if 'error' in result else ['error'])
+                writer = csv.DictWriter(stream, fieldnames=fieldnames, extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow({field: _csv_cell(value) for field, value in result.items()})
+        else:
+            stream.write(json.dumps(result, ensure_ascii=False) + '\n')
+        if count % flush_every == 0:
+            stream.flush()
+    stream.flush()
+
+
+def guess_format(path: str, default: str = 'jsonl') -> str:
+    """File format from the file extension"""
+    if path and path != '-':
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.jsonl', '.json', '.ndjson'):
+            return 'jsonl'
+    return default
@@ -0,0 +1,220 @@
+"""Continuous monitoring of pH/riego sensor readings from many plots
+
+SensorStream keeps the last recommendation of every plot and reports only
+the material changes; run_stream feeds it a table of readings:
+
+    python sistemaPlantas.py --headless --stream lecturas.jsonl -o cambios.jsonl --batch-size 100000
+"""
+from __future__ import annotations
+
+import time
+from itertools import islice
+from typing import Iterable, List, NamedTuple
+
+import nucleoPlantas as nucleo
+
+np = nucleo.LazyModule('numpy', 'np', globals())
+
+
+def _breakpoints(universe: np.ndarray, mfs: Iterable[np.ndarray]) -> np.ndarray:
+    """Sorted points where any of a variable's sampled membership functions changes slope"""
+    points = [universe[0], universe[-1]]
+    for mf in mfs:
+        slopes = np.diff(mf) / np.diff(universe)
+        points.extend(universe[np.flatnonzero(~np.isclose(slopes[1:], slopes[:-1])) + 1])
+    return np.unique(points)
+
+
+class PlotChange(NamedTuple):
+    """Change of a plot's recommendation, emitted by SensorStream"""
+    plot: object
+    ph: float
+    riego: float
+    value: float
+    plant: str
+    previous_value: float
+    previous_plant: str
+
+
+class SensorStream:
+    """Incremental recommendations for a stream of pH/riego readings from many plots
+    
+    Each plot remembers the inputs its fuzzy output was last computed from.
+    A new reading only triggers a recomputation when pH or riego moved more
+    than ph_tolerance / riego_tolerance from those inputs, or crossed a
+    corner of the model's membership functions (the rule-activation region
+    changed); otherwise the
+    previous output stands. A PlotChange is emitted when the recommended
+    plant changes or the crisp value moved more than value_tolerance since
+    the last event of that plot, and for the first reading of a plot.
+    
+    The stored output of a plot is therefore exact for inputs within the
+    tolerances of the current reading; tighten them to trade recomputations
+    for accuracy. Per-plot state lives in NumPy arrays and whole batches of
+    readings are processed with array operations and one vectorized fuzzy
+    call for the plots that need it, so 100k plots fit in a few MB.
+    """
+    
+    # Per-plot state arrays: inputs and region of the last computation, its
+    # output, and the value and plant of the last event
+    # (dtype strings, so defining the class does not import numpy)
+    STATE = (('ph', 'f8'), ('riego', 'f8'), ('region', 'i4'), ('value', 'f8'),
+             ('reported_value', 'f8'), ('plant', 'i1'))
+    
+    def __init__(self, ph_tolerance: float = 0.05, riego_tolerance: float = 0.05, value_tolerance: float = 0.05,
+                 model: nucleo.VectorizedFuzzyEngine = None, capacity: int = 1024):
+        self.ph_tolerance = ph_tolerance
+        self.riego_tolerance = riego_tolerance
+        self.value_tolerance = value_tolerance
+        self.model = model if model is not None else nucleo.shared_fuzzy_model()
+        self.ph_breakpoints = _breakpoints(self.model.acidez_universe, self.model.acidez_mfs)
+        self.riego_breakpoints = _breakpoints(self.model.riego_universe, self.model.riego_mfs)
+        
+        # plot id -> row of the state arrays
+        self.index = {}
+        self.plots = []
+        self._allocate(capacity)
+    
+    def _allocate(self, capacity: int):
+        """Grow the state arrays to capacity rows, keeping their contents"""
+        for name, dtype in self.STATE:
+            array = np.empty(capacity, dtype=dtype)
+            previous = getattr(self, name, None)
+            if previous is not None:
+                array[:len(previous)] = previous
+            setattr(self, name, array)
+    
+    def __len__(self) -> int:
+        return len(self.plots)
+    
+    def _rows(self, plots) -> np.ndarray:
+        """Rows of the given plots, registering the new ones"""
+        rows = list(map(self.index.get, plots))
+        if None in rows:
+            for i, plot in enumerate(plots):
+                if rows[i] is None:
+                    row = self.index.get(plot)
+                    if row is None:
+                        row = self.index[plot] = len(self.plots)
+                        self.plots.append(plot)
+                    rows[i] = row
+            if len(self.plots) > len(self.ph):
+                self._allocate(max(len(self.plots), 2 * len(self.ph)))
+        return np.array(rows, dtype=np.intp)
+    
+    def regions(self, ph_values, riego_values) -> np.ndarray:
+        """Rule-activation region of each input pair: the cell between membership function corners"""
+        ph_cells = np.searchsorted(self.ph_breakpoints, ph_values, side='right')
+        riego_cells = np.searchsorted(self.riego_breakpoints, riego_values, side='right')
+        return (ph_cells * (len(self.riego_breakpoints) + 1) + riego_cells).astype(np.int32)
+    
+    def update(self, plots, ph_values, riego_values) -> List[PlotChange]:
+        """Feed one batch of readings and return the resulting change events
+        
+        When a plot appears several times in a batch only its last reading
+        counts. Readings outside the valid ranges are skipped.
+        """
+        start = time.perf_counter()
+        plots = list(plots)
+        ph_values = np.asarray(ph_values, dtype=float)
+        riego_values = np.asarray(riego_values, dtype=float)
+        if not len(plots) == len(ph_values) == len(riego_values):
+            raise ValueError("Las lecturas deben tener la misma longitud.")
+        
+        valid = (ph_values >= 0) & (ph_values <= 14) & (riego_values >= 0) & (riego_values <= 10)
+        if not valid.all():
+            nucleo.METRICS.increment('stream_invalid', int(np.count_nonzero(~valid)))
+            plots = [plot for plot, ok in zip(plots, valid) if ok]
+            ph_values, riego_values = ph_values[valid], riego_values[valid]
+        
+        known = len(self.plots)
+        rows = self._rows(plots)
+        # Last reading per plot
+        _, last = np.unique(rows[::-1], return_index=True)
+        last = len(rows) - 1 - last
+        rows, ph_values, riego_values = rows[last], ph_values[last], riego_values[last]
+        
+        # Plots whose inputs left the tolerance box or their region
+        regions = self.regions(ph_values, riego_values)
+        new = rows >= known
+        stale = (new
+                 | (np.abs(ph_values - self.ph[rows]) > self.ph_tolerance)
+                 | (np.abs(riego_values - self.riego[rows]) > self.riego_tolerance)
+                 | (regions != self.region[rows]))
+        nucleo.METRICS.increment('stream_readings', len(rows))
+        if not stale.any():
+            nucleo.METRICS.observe('stream_update', time.perf_counter() - start)
+            return []
+        
+        rows, ph_values, riego_values = rows[stale], ph_values[stale], riego_values[stale]
+        new = new[stale]
+        values = self.model.compute(ph_values, riego_values)
+        plants = np.searchsorted(nucleo.PLANT_THRESHOLDS, values, side='right').astype(np.int8)
+        self.ph[rows] = ph_values
+        self.riego[rows] = riego_values
+        self.region[rows] = regions[stale]
+        self.value[rows] = values
+        nucleo.METRICS.increment('stream_recomputed', len(rows))
+        
+        # Events: new plots, plant changes and material value changes
+        previous_values = self.reported_value[rows]
+        previous_plants = self.plant[rows]
+        changed = new | (plants != previous_plants) | (np.abs(values - previous_values) > self.value_tolerance)
+        changed_rows = rows[changed]
+        self.reported_value[changed_rows] = values[changed]
+        self.plant[changed_rows] = plants[changed]
+        events = [
+            PlotChange(self.plots[row], ph, riego, value, nucleo.PLANT_NAMES[plant],
+                       None if is_new else previous_value, None if is_new else nucleo.PLANT_NAMES[previous_plant])
+            for row, ph, riego, value, plant, previous_value, previous_plant, is_new in zip(
+                changed_rows.tolist(), ph_values[changed].tolist(), riego_values[changed].tolist(),
+                values[changed].tolist(), plants[changed].tolist(), previous_values[changed].tolist(),
+                previous_plants[changed].tolist(), new[changed].tolist())
+        ]
+        nucleo.METRICS.increment('stream_events', len(events))
+        nucleo.METRICS.observe('stream_update', time.perf_counter() - start)
+        return events
+    
+    def update_one(self, plot, ph_value: float, riego_value: float) -> List[PlotChange]:
+        """Feed a single reading; raises ValueError if it is out of range"""
+        nucleo.validate_inputs(ph_value, riego_value)
+        return self.update([plot], [ph_value], [riego_value])
+    
+    def current(self, plot) -> nucleo.Recommendation:
+        """Latest recommendation of a plot, from the inputs it was last computed with"""
+        row = self.index[plot]
+        value = float(self.value[row])
+        return nucleo.Recommendation(float(self.ph[row]), float(self.riego[row]), value, nucleo.recommend_plant(value))
+
+
+def run_stream(input_path: str = '-', output_path: str = '-', input_format: str = None, batch_size: int = 1000,
+               stream: SensorStream = None):
+    """Feed sensor readings (parcela, ph, riego) to a SensorStream and write its change events as JSONL
+    
+    Readings are taken batch_size at a time, so a live feed should use a
+    batch size close to the number of readings per sensor cycle.
+    """
+    stream = stream if stream is not None else SensorStream()
+    input_format = input_format or nucleo.guess_format(input_path)
+    with nucleo.open_records(input_path, output_path) as (source, target):
+        records = nucleo.read_records(source, input_format)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            plots, ph_values, riego_values = [], [], []
+            for record in batch:
+                try:
+                    ph_value = nucleo.parse_number(record.get(nucleo.RECORD_PH))
+                    riego_value = nucleo.parse_number(record.get(nucleo.RECORD_RIEGO))
+                    # Plot ids index the stream's state, so lists or objects are skipped too
+                    hash(record.get(nucleo.RECORD_PLOT))
+                except (TypeError, ValueError):
+                    continue
+                if record.get(nucleo.RECORD_PLOT) is None or ph_value is None or riego_value is None:
+                    continue
+                plots.append(record[nucleo.RECORD_PLOT])
+                ph_values.append(ph_value)
+                riego_values.append(riego_value)
+            events = stream.update(plots, ph_values, riego_values)
+            nucleo.write_records((event._asdict() for event in events), target, 'jsonl', flush_every=batch_size)
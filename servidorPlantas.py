@@ -0,0 +1,399 @@
+"""Local HTTP/JSON service for plant diagnosis and recommendation
+
+Serves the expert system and the fuzzy recommendation without Tk:
+
+    python servidorPlantas.py --port 8080 --engines 4
+
+Every endpoint takes one field record as a JSON object, with the same fields
+as the headless pipeline (one key per symptom category, plus ph and riego):
+
+    POST /diagnostico    -> deficiencias, tratamientos
+    POST /recomendacion  -> valor, planta
+    POST /evaluar        -> the whole pipeline result
+    GET  /salud          -> status and pending requests
+    GET  /metricas       -> phase metrics in the Prometheus text format
+
+Requests wait in a bounded queue (503 when full). A fixed pool of engines,
+built and warmed up before the server starts listening, takes them from the
+queue in batches, so a burst costs one vectorized fuzzy call per batch; a
+record that cannot be served gets its own 400 (or 500) without failing the
+rest of its batch (python servidorPlantas.py --check verifies this). On
+SIGINT/SIGTERM the server stops accepting connections, answers everything
+already queued and then exits.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, NamedTuple
+
+import mascarasPlantas as mascaras
+import nucleoPlantas as nucleo
+
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024
+
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 30.0
+
+# Fields of the pipeline result returned by each endpoint (None = all of them)
+ENDPOINTS = {
+    '/diagnostico': ('deficiencias', 'tratamientos'),
+    '/recomendacion': ('valor', 'planta'),
+    '/evaluar': None,
+}
+
+# Fields that must all be computed for /evaluar to succeed
+EVALUATED_FIELDS = ('deficiencias', 'tratamientos', 'valor', 'planta')
+
+
+class EngineSlot:
+    """One diagnosis engine and one fuzzy engine, used by a single batch at a time"""
+
+    def __init__(self, fuzzy_mode: str = 'exact', diagnosis_engine: str = 'clips'):
+        if diagnosis_engine == 'bitmask':
+            engine = mascaras.BitmaskDiagnosisEngine()
+        else:
+            engine = nucleo.DiagnosisEngine(nucleo.create_expert_system(snapshot=True))
+        self.diagnosis = nucleo.DiagnosisCache(engine)
+        self.recommendation = nucleo.RecommendationEngine(mode=fuzzy_mode)
+
+    def warm_up(self):
+        """Build the lazy parts (skfuzzy, surfaces, CLIPS agenda) before the first request"""
+        self.evaluate([{nucleo.RECORD_PH: 6.5, nucleo.RECORD_RIEGO: 4.0, 'Color de hojas': 'verde pálido'}])
+        self.diagnosis.clear()
+
+    def evaluate(self, records: List[Dict]) -> List[Dict]:
+        """Pipeline results of a batch of records"""
+        return list(nucleo.process_records(records, len(records), self.diagnosis, self.recommendation))
+
+
+class EnginePool:
+    """Fixed set of pre-warmed engine slots, checked out by one batch at a time"""
+
+    def __init__(self, size: int, fuzzy_mode: str = 'exact', diagnosis_engine: str = 'clips'):
+        self.slots = [EngineSlot(fuzzy_mode, diagnosis_engine) for _ in range(size)]
+        for slot in self.slots:
+            slot.warm_up()
+        self._idle = None
+
+    @contextlib.asynccontextmanager
+    async def checkout(self):
+        """Wait for an idle slot and hold it for the duration of the block"""
+        if self._idle is None:
+            # Created here so the queue belongs to the running event loop
+            self._idle = asyncio.Queue()
+            for slot in self.slots:
+                self._idle.put_nowait(slot)
+        slot = await self._idle.get()
+        try:
+            yield slot
+        finally:
+            self._idle.put_nowait(slot)
+
+
+class Job(NamedTuple):
+    record: Dict
+    future: asyncio.Future
+
+
+class PlantServer:
+    """asyncio HTTP/1.1 server feeding a bounded queue drained in batches by the engine pool"""
+
+    def __init__(self, pool: EnginePool, max_pending: int = 1024, batch_size: int = 64,
+                 batch_wait: float = 0.0):
+        self.pool = pool
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.executor = ThreadPoolExecutor(max_workers=len(pool.slots), thread_name_prefix='motor')
+        self.queue = None
+        self.server = None
+        self.closing = False
+        self._consumers = []
+        # Open connections: writer -> (handler task, busy answering a request)
+        self._connections = {}
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080):
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self._consumers = [asyncio.create_task(self._consume()) for _ in self.pool.slots]
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def shutdown(self, timeout: float = 10.0):
+        """Stop accepting connections, answer the queued requests and release the engines"""
+        self.closing = True
+        self.server.close()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"{self.queue.qsize()} solicitudes sin atender al cerrar", file=sys.stderr)
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        # Idle keep-alive connections are closed; busy ones finish writing their answer
+        for writer, (_, busy) in list(self._connections.items()):
+            if not busy:
+                writer.close()
+        handlers = [task for task, _ in self._connections.values()]
+        if handlers:
+            await asyncio.wait(handlers, timeout=timeout)
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, record: Dict) -> Dict:
+        """Queue one record and wait for its result; raises asyncio.QueueFull when saturated"""
+        job = Job(record, asyncio.get_running_loop().create_future())
+        self.queue.put_nowait(job)
+        return await job.future
+
+    async def _next_batch(self) -> List[Job]:
+        """First queued job plus whatever else is already waiting, up to batch_size"""
+        batch = [await self.queue.get()]
+        if self.batch_wait and self.queue.qsize() < self.batch_size - 1:
+            await asyncio.sleep(self.batch_wait)
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            start = time.perf_counter()
+            try:
+                async with self.pool.checkout() as slot:
+                    records = [job.record for job in batch]
+                    try:
+                        outcomes = await loop.run_in_executor(self.executor, slot.evaluate, records)
+                    except Exception:
+                        if len(batch) == 1:
+                            raise
+                        # Some record breaks the batch: evaluate them one at a time so only that one fails
+                        nucleo.METRICS.increment('server_batch_retries')
+                        outcomes = []
+                        for record in records:
+                            try:
+                                outcomes.extend(await loop.run_in_executor(self.executor, slot.evaluate, [record]))
+                            except Exception as e:
+                                outcomes.append(e)
+                for job, outcome in zip(batch, outcomes):
+                    if job.future.done():
+                        continue
+                    if isinstance(outcome, Exception):
+                        job.future.set_exception(outcome)
+                    else:
+                        job.future.set_result(outcome)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            finally:
+                nucleo.METRICS.observe('server_batch', time.perf_counter() - start)
+                nucleo.METRICS.increment('server_batches')
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[writer] = (task, False)
+        try:
+            while not self.closing:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    await _write_response(writer, HTTPStatus.BAD_REQUEST, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                self._connections[writer] = (task, True)
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                start = time.perf_counter()
+                status, payload = await self._dispatch(method, path, body)
+                nucleo.METRICS.observe('server_request', time.perf_counter() - start)
+                nucleo.METRICS.increment(f'server_status_{int(status)}')
+                await _write_response(writer, status, payload, keep_alive and not self.closing)
+                self._connections[writer] = (task, False)
+                if not keep_alive:
+                    break
+        finally:
+            del self._connections[writer]
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _dispatch(self, method: str, path: str, body: bytes):
+        """Status and JSON payload (or Prometheus text) for one request"""
+        if path == '/salud' and method == 'GET':
+            estado = 'cerrando' if self.closing else 'ok'
+            return HTTPStatus.OK, {'estado': estado, 'pendientes': self.queue.qsize(),
+                                   'motores': len(self.pool.slots)}
+        if path == '/metricas' and method == 'GET':
+            return HTTPStatus.OK, nucleo.METRICS.to_prometheus()
+        if path not in ENDPOINTS:
+            return HTTPStatus.NOT_FOUND, {'error': f"Ruta desconocida: {path}"}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Use POST"}
+        if self.closing:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "El servidor se está cerrando"}
+
+        try:
+            record = json.loads(body or b'{}')
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {'error': "El cuerpo no es JSON válido"}
+        if not isinstance(record, dict):
+            return HTTPStatus.BAD_REQUEST, {'error': "Se esperaba un objeto JSON"}
+
+        try:
+            result = await self.submit(record)
+        except asyncio.QueueFull:
+            nucleo.METRICS.increment('server_rejected')
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Demasiadas solicitudes pendientes"}
+        except Exception as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+
+        # A record error only fails the endpoints whose fields it left empty
+        fields = ENDPOINTS[path]
+        if 'error' in result and any(result[field] is None for field in fields or EVALUATED_FIELDS):
+            return HTTPStatus.BAD_REQUEST, {'error': result['error']}
+        return HTTPStatus.OK, result if fields is None else {field: result[field] for field in fields}
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """(method, path, headers, body) of the next request, or None at end of stream"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise ValueError("Línea de solicitud inválida")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0) or 0)
+    if length > MAX_BODY:
+        raise ValueError(f"Cuerpo demasiado grande (máximo {MAX_BODY} bytes)")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target.split('?', 1)[0], headers, body
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: HTTPStatus, payload, keep_alive: bool = True):
+    if isinstance(payload, str):
+        body = payload.encode('utf-8')
+        content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    else:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        content_type = 'application/json; charset=utf-8'
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+    if status == HTTPStatus.SERVICE_UNAVAILABLE:
+        head += "Retry-After: 1\r\n"
+    writer.write(head.encode('latin-1') + b'\r\n' + body)
+    with contextlib.suppress(ConnectionError):
+        await writer.drain()
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8080, engines: int = 2, max_pending: int = 1024,
+                batch_size: int = 64, batch_wait: float = 0.0, fuzzy_mode: str = 'exact',
+                diagnosis_engine: str = 'clips', shutdown_timeout: float = 10.0):
+    """Run the server until SIGINT or SIGTERM, then shut it down gracefully"""
+    start = time.perf_counter()
+    pool = EnginePool(engines, fuzzy_mode, diagnosis_engine)
+    server = PlantServer(pool, max_pending, batch_size, batch_wait)
+    await server.start(host, port)
+    print(f"Escuchando en http://{host}:{server.port} ({engines} motores listos en "
+          f"{time.perf_counter() - start:.2f} s)", file=sys.stderr)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    print("Cerrando...", file=sys.stderr)
+    await server.shutdown(shutdown_timeout)
+
+
+def check_batch_isolation(diagnosis_engine: str = 'clips') -> List[str]:
+    """Send a valid and an invalid /diagnostico request together and check they share a batch
+
+    The invalid one must get its 400 and the valid one its diagnosis, as if
+    each had been sent alone. Returns the problems found, empty when none.
+    """
+    good = {'Color de hojas': 'verde pálido'}
+    bad = {'Color de hojas': 5}
+
+    async def run():
+        pool = EnginePool(1, diagnosis_engine=diagnosis_engine)
+        server = PlantServer(pool, batch_wait=0.05)
+        await server.start(port=0)
+        batches = nucleo.METRICS.counters.get('server_batches', 0)
+        try:
+            answers = await asyncio.gather(*(server._dispatch('POST', '/diagnostico', json.dumps(record).encode())
+                                             for record in (good, bad)))
+        finally:
+            await server.shutdown()
+        expected = pool.slots[0].evaluate([good])[0]
+        return answers, nucleo.METRICS.counters.get('server_batches', 0) - batches, expected
+
+    ((good_status, good_payload), (bad_status, bad_payload)), batches, expected = asyncio.run(run())
+    problems = []
+    if batches != 1:
+        problems.append(f"Las dos solicitudes se atendieron en {batches} lotes en lugar de uno")
+    if good_status != HTTPStatus.OK or good_payload != {field: expected[field] for field in ENDPOINTS['/diagnostico']}:
+        problems.append(f"Solicitud válida: {good_status.value} {good_payload}")
+    if bad_status != HTTPStatus.BAD_REQUEST:
+        problems.append(f"Solicitud inválida: {bad_status.value} {bad_payload}")
+    return problems
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Servidor HTTP del sistema de plantas")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--engines', type=int, default=2, help="motores precalentados en el pool")
+    parser.add_argument('--max-pending', type=int, default=1024,
+                        help="solicitudes en cola antes de responder 503")
+    parser.add_argument('--batch-size', type=int, default=64, help="solicitudes atendidas por lote")
+    parser.add_argument('--batch-wait-ms', type=float, default=0.0,
+                        help="espera para completar un lote pequeño, en milisegundos")
+    parser.add_argument('--fuzzy-mode', choices=nucleo.RecommendationEngine.MODES, default='exact')
+    parser.add_argument('--diagnosis-engine', choices=('clips', 'bitmask'), default='clips')
+    parser.add_argument('--shutdown-timeout', type=float, default=10.0,
+                        help="segundos para atender la cola al cerrar")
+    parser.add_argument('--check', action='store_true',
+                        help="comprobar que una solicitud inválida no hace fallar a las demás de su lote y terminar")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = check_batch_isolation(args.diagnosis_engine)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        print(f"{len(problems)} problemas en el aislamiento de lotes")
+        return 1 if problems else 0
+
+    asyncio.run(serve(args.host, args.port, args.engines, args.max_pending, args.batch_size,
+                      args.batch_wait_ms / 1000, args.fuzzy_mode, args.diagnosis_engine,
+                      args.shutdown_timeout))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
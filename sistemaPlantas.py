@@ -1,12 +1,95 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-import clips
-import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from typing import Dict, List, Tuple, Set
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from typing import List
+
+from nucleoPlantas import (DiagnosisCache, DiagnosisEngine, DiagnosisResult, FuzzyEvaluation,
+                          IncrementalDiagnosis, LazyModule, METRICS, PLANT_DESCRIPTIONS,
+                          Recommendation, RecommendationEngine, RecommendationPlot,
+                          SYMPTOM_CATEGORIES, all_symptom_sets, check_incremental_equivalence,
+                          create_expert_system, create_fuzzy_system, evaluate_recommendation,
+                          guess_format, normalize_symptoms, open_records, process_records,
+                          read_records, recommend_plant, shared_fuzzy_model, timed, validate_inputs,
+                          write_records)
+
+
+# Heavy dependencies are only loaded by the tab or API that needs them
+tk = LazyModule('tkinter', 'tk', globals())
+ttk = LazyModule('tkinter.ttk', 'ttk', globals())
+messagebox = LazyModule('tkinter.messagebox', 'messagebox', globals())
+
+# Subsystems built on nucleoPlantas, loaded by the mode or tab that uses them
+diferencial = LazyModule('diferencialPlantas', 'diferencial', globals())
+historial = LazyModule('historialPlantas', 'historial', globals())
+informe = LazyModule('informePlantas', 'informe', globals())
+mascaras = LazyModule('mascarasPlantas', 'mascaras', globals())
+sensores = LazyModule('sensoresPlantas', 'sensores', globals())
+sitio = LazyModule('sitioPlantas', 'sitio', globals())
+
+
+class LatestRequestWorker:
+    """Background thread that only ever computes the most recent request
+    
+    submit() replaces any request still waiting, so stale inputs are never
+    computed, and results that were overtaken while computing are dropped.
+    Results are put on a queue for the caller's thread (e.g. the Tk main loop)
+    to collect; nothing here touches the caller's objects.
+    """
+    
+    def __init__(self, function):
+        self.function = function
+        self.results = queue.Queue()
+        self.generation = 0
+        self._request = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def submit(self, *args) -> int:
+        """Queue a request, discarding any older one not yet started"""
+        with self._condition:
+            self.generation += 1
+            self._request = (self.generation, args)
+            self._condition.notify()
+            return self.generation
+    
+    def close(self):
+        """Stop the worker thread after the current request"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._request is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                generation, args = self._request
+                self._request = None
+            
+            try:
+                result, error = self.function(*args), None
+            except Exception as e:
+                result, error = None, e
+            
+            if generation == self.generation:
+                self.results.put((generation, result, error))
+
+
+# Live preview timings (milliseconds)
+PREVIEW_DEBOUNCE_MS = 60
+PREVIEW_POLL_MS = 15
+
 
 class PlantExpertSystemGUI:
     def __init__(self, root):
@@ -33,23 +116,72 @@ class PlantExpertSystemGUI:
         # Initialize fuzzy logic tab
         self.init_fuzzy_logic_tab()
         
-        # Create the fuzzy logic system
-        self.create_fuzzy_system()
+        # The fuzzy logic system is created when its tab is first shown
+        self.sistema = None
+        
+        # Results are saved to the history database, opened on first use
+        self._history = None
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+    
+    def on_tab_changed(self, event):
+        """Build the engine behind a tab the first time the tab is shown"""
+        if self.notebook.select() == str(self.fuzzy_tab):
+            self.root.after_idle(self.ensure_fuzzy_system)
+    
+    @property
+    def engine(self):
+        """Incremental diagnosis of the form, with its CLIPS environment built on first use"""
+        if self._engine is None:
+            self._engine = IncrementalDiagnosis(self.create_expert_system())
+        return self._engine
+    
+    @property
+    def env(self):
+        """The CLIPS environment behind the diagnosis engine"""
+        return self.engine.env
+    
+    @property
+    def history(self):
+        """History database of this session's results, or None if it cannot be opened"""
+        if self._history is None:
+            try:
+                # One result per click: write each one right away
+                self._history = historial.HistoryStore(batch_size=1)
+            except (OSError, sqlite3.Error) as e:
+                print(f"No se puede abrir el historial {historial.HISTORY_PATH}: {e}", file=sys.stderr)
+                self._history = False
+        return self._history or None
+    
+    def save_to_history(self, diagnosis: DiagnosisResult = None, recommendation: Recommendation = None):
+        """Write a result to the history; a database error is reported without interrupting the GUI"""
+        history = self.history
+        if history is None:
+            return
+        try:
+            if diagnosis is not None:
+                history.record_diagnosis(diagnosis)
+            if recommendation is not None:
+                history.record_recommendation(recommendation)
+        except sqlite3.Error as e:
+            print(f"No se puede guardar en el historial {historial.HISTORY_PATH}: {e}", file=sys.stderr)
+    
+    @property
+    def ranking(self):
+        """Confidence scoring of the deficiencies, built on first use"""
+        if self._ranking is None:
+            self._ranking = diferencial.DifferentialDiagnosis()
+        return self._ranking
     
     def init_expert_system_tab(self):
         # Symptom categories and options
-        self.symptom_categories = {
-            "Color de hojas": ["verde pálido", "amarillo uniforme", "púrpura o rojizo", "bordes secos o quemados"],
-            "Condición de hojas": ["marchitas", "crecimiento atrofiado"],
-            "Condición de tallo": ["débil o quebradizo", "engrosado"],
-            "Crecimiento y desarrollo": ["maduración tardía", "floración ausente"]
-        }
+        self.symptom_categories = SYMPTOM_CATEGORIES
         
         # Selected symptoms
         self.selected_symptoms = {}
         
-        # Create the CLIPS environment
-        self.env = self.create_expert_system()
+        # The CLIPS environment and the ranking matrix are created on the first diagnosis
+        self._engine = None
+        self._ranking = None
         
         # Create the main frame
         self.main_frame = ttk.Frame(self.expert_tab, padding=20)
@@ -198,7 +330,7 @@ class PlantExpertSystemGUI:
             to=14,
             orient=tk.HORIZONTAL,
             variable=self.ph_var,
-            command=lambda v: self.ph_var.set(f"{float(v):.1f}")
+            command=lambda v: self.on_scale_moved(self.ph_var, v)
         )
         ph_scale.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
         
@@ -240,7 +372,7 @@ class PlantExpertSystemGUI:
             to=10,
             orient=tk.HORIZONTAL,
             variable=self.riego_var,
-            command=lambda v: self.riego_var.set(f"{float(v):.1f}")
+            command=lambda v: self.on_scale_moved(self.riego_var, v)
         )
         riego_scale.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
         
@@ -259,6 +391,19 @@ class PlantExpertSystemGUI:
         )
         calculate_button.pack(side=tk.RIGHT)
         
+        # Live preview while dragging the sliders
+        self.live_preview_var = tk.BooleanVar(value=False)
+        live_preview_check = ttk.Checkbutton(
+            buttons_frame,
+            text="Vista previa en vivo",
+            variable=self.live_preview_var,
+            command=self.schedule_preview
+        )
+        live_preview_check.pack(side=tk.LEFT)
+        self.preview_worker = None
+        self.preview_after_id = None
+        self.preview_polling = False
+        
         # Right column - Results and graph
         self.fuzzy_right_frame = ttk.LabelFrame(content_frame, text="Resultados y Gráfico", padding=10)
         self.fuzzy_right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(10, 0))
@@ -277,9 +422,10 @@ class PlantExpertSystemGUI:
         )
         recommendation_label.pack(fill=tk.X)
         
-        # Graph frame
+        # Graph frame, with the figure created on the first result
         self.graph_frame = ttk.Frame(self.fuzzy_right_frame)
         self.graph_frame.pack(fill=tk.BOTH, expand=True)
+        self.figure = None
         
         # Footer
         footer_frame = ttk.Frame(self.fuzzy_main_frame, padding=(0, 20, 0, 0))
@@ -321,6 +467,7 @@ class PlantExpertSystemGUI:
             )
             symptom_combobox.pack(fill=tk.X, pady=(5, 0))
             symptom_combobox.current(0)
+            symptom_combobox.bind("<<ComboboxSelected>>", self.on_symptom_changed)
             
             # Store the variable for later access
             self.selected_symptoms[category] = symptom_var
@@ -331,127 +478,32 @@ class PlantExpertSystemGUI:
     
     def create_expert_system(self):
         """Create the CLIPS expert system environment"""
-        env = clips.Environment()
-        env.clear()
-
-        # Define templates
-        env.build("""
-            (deftemplate diagnostico (slot deficiencia (type STRING)))
-        """)
-        env.build("""
-            (deftemplate sintoma (slot categoria (type STRING)) (slot caracteristica (type STRING)))
-        """)
-        env.build("""
-            (deftemplate tratamiento (slot recomendacion (type STRING)))
-        """)
-
-        # Rules for nutrient deficiencies
-        env.build("""
-            (defrule nitrogeno-deficiencia
-                (or (sintoma (categoria "Color de hojas") (caracteristica "verde pálido"))
-                    (sintoma (categoria "Condición de hojas") (caracteristica "crecimiento atrofiado")))
-                =>
-                (assert (diagnostico (deficiencia "nitrogeno"))))
-        """)
-        env.build("""
-            (defrule potasio-deficiencia
-                (or (sintoma (categoria "Color de hojas") (caracteristica "bordes secos o quemados"))
-                    (sintoma (categoria "Condición de tallo") (caracteristica "débil o quebradizo")))
-                =>
-                (assert (diagnostico (deficiencia "potasio"))))
-        """)
-        env.build("""
-            (defrule fosforo-deficiencia
-                (or (sintoma (categoria "Color de hojas") (caracteristica "púrpura o rojizo"))
-                    (sintoma (categoria "Crecimiento y desarrollo") (caracteristica "maduración tardía")))
-                =>
-                (assert (diagnostico (deficiencia "fosforo"))))
-        """)
-
-        # Treatment rules
-        env.build("""
-            (defrule nitrogeno-tratamiento
-                (diagnostico (deficiencia "nitrogeno"))
-                =>
-                (assert (tratamiento (recomendacion "Aplicar fertilizante con urea o nitrato de amonio"))))
-        """)
-        env.build("""
-            (defrule potasio-tratamiento
-                (diagnostico (deficiencia "potasio"))
-                =>
-                (assert (tratamiento (recomendacion "Añadir fertilizante rico en potasio, como ceniza de madera o sulfato de potasio"))))
-        """)
-        env.build("""
-            (defrule fosforo-tratamiento
-                (diagnostico (deficiencia "fosforo"))
-                =>
-                (assert (tratamiento (recomendacion "Incorporar fertilizantes con fosfato, como superfosfato de calcio"))))
-        """)
-        
-        return env
+        return create_expert_system()
     
     def create_fuzzy_system(self):
         """Create the fuzzy logic system for plant recommendation"""
-        # Definición de los antecedentes (entradas)
-        self.acidez = ctrl.Antecedent(np.arange(0, 14, 0.1), 'acidez')  # pH del suelo
-        self.riego = ctrl.Antecedent(np.arange(0, 10, 0.1), 'riego')  # Frecuencia de riego
-
-        # Definición del consecuente (salida)
-        self.planta = ctrl.Consequent(np.arange(0, 5, 0.1), 'planta')  # Tipo de planta
-
-        # Definir conjuntos difusos
-        self.acidez['ácido'] = fuzz.trapmf(self.acidez.universe, [0, 0, 4.5, 6.5])
-        self.acidez['neutro'] = fuzz.trapmf(self.acidez.universe, [4.5, 6.5, 8, 10])
-        self.acidez['alcalino'] = fuzz.trapmf(self.acidez.universe, [8, 10, 14, 14])
-
-        self.riego['bajo'] = fuzz.trapmf(self.riego.universe, [0, 0, 3, 4.5])
-        self.riego['medio'] = fuzz.trapmf(self.riego.universe, [3, 4.5, 6, 7])
-        self.riego['alto'] = fuzz.trapmf(self.riego.universe, [6, 7, 10, 10])
-
-        self.planta['cactus'] = fuzz.trapmf(self.planta.universe, [0, 0, 0.7, 1.5])
-        self.planta['rosal'] = fuzz.trapmf(self.planta.universe, [1, 1.5, 2.2, 3.3])
-        self.planta['helecho'] = fuzz.trapmf(self.planta.universe, [2.5, 3.3, 4, 4.5])
-
-        # # Definir reglas difusas
-        # rule1 = ctrl.Rule(self.acidez['ácido'] & self.riego['alto'], self.planta['helecho'])
-        # rule2 = ctrl.Rule(self.acidez['neutro'] & self.riego['medio'], self.planta['rosal'])
-        # rule3 = ctrl.Rule(self.acidez['alcalino'] & self.riego['bajo'], self.planta['cactus'])
-
-        # # Crear el sistema de control
-        # self.planta_ctrl = ctrl.ControlSystem([rule1, rule2, rule3])
-        # self.sistema = ctrl.ControlSystemSimulation(self.planta_ctrl)
-
-        # Definir reglas
-        rules = [
-            ctrl.Rule(self.acidez['ácido'] & self.riego['alto'], self.planta['helecho']),
-            ctrl.Rule(self.acidez['ácido'] & self.riego['medio'], self.planta['helecho']),
-            ctrl.Rule(self.acidez['ácido'] & self.riego['bajo'], self.planta['rosal']),
-            ctrl.Rule(self.acidez['neutro'] & self.riego['alto'], self.planta['helecho']),
-            ctrl.Rule(self.acidez['neutro'] & self.riego['medio'], self.planta['rosal']),
-            ctrl.Rule(self.acidez['neutro'] & self.riego['bajo'], self.planta['rosal']),
-            ctrl.Rule(self.acidez['alcalino'] & self.riego['alto'], self.planta['helecho']),
-            ctrl.Rule(self.acidez['alcalino'] & self.riego['medio'], self.planta['rosal']),
-            ctrl.Rule(self.acidez['alcalino'] & self.riego['bajo'], self.planta['cactus'])
-        ]
-
-        # Crear sistema de control
-        self.planta_ctrl = ctrl.ControlSystem(rules)
-        self.sistema = ctrl.ControlSystemSimulation(self.planta_ctrl)
+        self.acidez, self.riego, self.planta, self.planta_ctrl = create_fuzzy_system()
+        self.sistema = FuzzyEvaluation(shared_fuzzy_model())
+    
+    def ensure_fuzzy_system(self):
+        """Create the fuzzy logic system unless it already exists"""
+        if self.sistema is None:
+            self.create_fuzzy_system()
     
     def calculate_recommendation(self):
         """Calculate plant recommendation based on pH and watering frequency"""
+        self.ensure_fuzzy_system()
+        total_start = time.perf_counter()
         try:
             # Get input values
             ph_value = float(self.ph_var.get())
             riego_value = float(self.riego_var.get())
             
             # Validate input ranges
-            if not (0 <= ph_value <= 14):
-                messagebox.showerror("Error", "El valor de pH debe estar entre 0 y 14.")
-                return
-            
-            if not (0 <= riego_value <= 10):
-                messagebox.showerror("Error", "La frecuencia de riego debe estar entre 0 y 10.")
+            try:
+                validate_inputs(ph_value, riego_value)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 return
 
             # if ( ph_value < 6.5 and riego_value > 3 or ph_value < 6.5 and riego_value < 3 ):
@@ -467,92 +519,156 @@ class PlantExpertSystemGUI:
             self.sistema.input['riego'] = riego_value
             
             # Compute the result
+            start = time.perf_counter()
             self.sistema.compute()
+            METRICS.observe('fuzzy_exact', time.perf_counter() - start)
             
             # Get the result
             resultado = self.sistema.output['planta']
             
-            # Determine the plant type based on the result
-            if resultado < 1.5:
-                planta_recomendada = "Cactus"
-                descripcion = "Los cactus son ideales para suelos alcalinos con baja frecuencia de riego."
-            elif resultado < 3:
-                planta_recomendada = "Rosal"
-                descripcion = "Los rosales prefieren suelos neutros con frecuencia de riego media."
-            else:
-                planta_recomendada = "Helecho"
-                descripcion = "Los helechos prosperan en suelos ácidos con alta frecuencia de riego."
-            
-            # Update the recommendation label
-            self.recommendation_var.set(f"Planta recomendada: {planta_recomendada}\n\n{descripcion}\n\nValor numérico: {resultado:.2f}")
-            
-            # Update the graph
-            self.update_graph(resultado)
+            # Show the result
+            self.show_recommendation(resultado, self.sistema.cuts)
+            self.save_to_history(
+                recommendation=Recommendation(ph_value, riego_value, resultado, recommend_plant(resultado)))
+            METRICS.observe('recommendation', time.perf_counter() - total_start)
             
         except ValueError:
             messagebox.showerror("Error", "Por favor ingrese valores numéricos válidos.")
     
-    def update_graph(self, resultado):
-        """Update the fuzzy logic graph with the current result"""
-        # Clear the graph frame
-        for widget in self.graph_frame.winfo_children():
-            widget.destroy()
-        
-        # Create a new figure
-        fig, ax = plt.subplots(figsize=(6, 4)) 
+    def show_recommendation(self, resultado, cuts):
+        """Display a fuzzy result in the recommendation label and graph"""
+        # Determine the plant type based on the result
+        planta_recomendada = recommend_plant(resultado)
+        descripcion = PLANT_DESCRIPTIONS[planta_recomendada]
         
-        # Plot the membership functions
-        self.planta.view(sim=self.sistema, ax=ax)
+        # Update the recommendation label
+        self.recommendation_var.set(f"Planta recomendada: {planta_recomendada}\n\n{descripcion}\n\nValor numérico: {resultado:.2f}")
         
-        # Add a vertical line at the result value
-        ax.axvline(x=resultado, color='black', linestyle='-', linewidth=2)
+        # Update the graph
+        self.update_graph(resultado, cuts)
+    
+    def on_scale_moved(self, var, value):
+        """Round a slider value into its entry and refresh the live preview"""
+        var.set(f"{float(value):.1f}")
+        self.schedule_preview()
+    
+    def schedule_preview(self):
+        """Debounce slider motion: only submit once it pauses for PREVIEW_DEBOUNCE_MS"""
+        if not self.live_preview_var.get():
+            return
+        if self.preview_after_id is not None:
+            self.root.after_cancel(self.preview_after_id)
+        self.preview_after_id = self.root.after(PREVIEW_DEBOUNCE_MS, self.submit_preview)
+    
+    def submit_preview(self):
+        """Send the current inputs to the background worker"""
+        self.preview_after_id = None
+        try:
+            ph_value = float(self.ph_var.get())
+            riego_value = float(self.riego_var.get())
+            validate_inputs(ph_value, riego_value)
+        except ValueError:
+            # Half-typed or out of range values are simply not previewed
+            return
         
-        # Create a canvas to display the plot
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
+        self.ensure_fuzzy_system()
+        if self.preview_worker is None:
+            # Same model as the Calcular button, so confirming does not change the value
+            self.preview_worker = LatestRequestWorker(
+                functools.partial(evaluate_recommendation, model=self.sistema.model))
+        self.preview_worker.submit(ph_value, riego_value)
+        if not self.preview_polling:
+            self.preview_polling = True
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+    
+    def poll_preview(self):
+        """Collect worker results on the Tk thread, keeping only the latest one"""
+        latest = None
+        while True:
+            try:
+                latest = self.preview_worker.results.get_nowait()
+            except queue.Empty:
+                break
+        
+        if latest is not None:
+            generation, result, error = latest
+            if error is None and generation == self.preview_worker.generation:
+                self.show_recommendation(*result)
+        
+        # Keep polling while a newer request is still in flight
+        if latest is None or latest[0] != self.preview_worker.generation:
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+        else:
+            self.preview_polling = False
+    
+    def init_graph(self):
+        """Create the recommendation plot and its canvas once"""
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        self.plot = RecommendationPlot(self.planta)
+        self.figure = self.plot.figure
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.graph_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        
+        # draw_idle() renders later from the Tk loop, so time the render itself
+        self.canvas.draw = timed('plot_render', self.canvas.draw)
+    
+    def update_graph(self, resultado, cuts):
+        """Update the fuzzy logic graph with the current result and output activations"""
+        if self.figure is None:
+            self.init_graph()
+        start = time.perf_counter()
+        self.plot.update(resultado, cuts)
+        self.canvas.draw_idle()
+        METRICS.observe('plot_update', time.perf_counter() - start)
+    
+    def on_symptom_changed(self, event=None):
+        """Re-diagnose as soon as a selection changes, applying only that edit"""
+        result = self.engine.update({category: var.get() for category, var in self.selected_symptoms.items()})
+        selected = normalize_symptoms(result.symptoms)
+        if selected:
+            self.show_diagnosis(selected, result)
+        else:
+            self.results_text.config(state=tk.NORMAL)
+            self.results_text.delete(1.0, tk.END)
+            self.results_text.config(state=tk.DISABLED)
     
     def run_diagnosis(self):
         """Run the expert system diagnosis based on selected symptoms"""
-        # Clear previous results
-        self.results_text.config(state=tk.NORMAL)
-        self.results_text.delete(1.0, tk.END)
-        
-        # Reset the CLIPS environment
-        self.env.reset()
-        
         # Get selected symptoms
-        selected = []
-        for category, var in self.selected_symptoms.items():
-            symptom = var.get()
-            if symptom:
-                selected.append((category, symptom))
+        selected = normalize_symptoms((category, var.get()) for category, var in self.selected_symptoms.items())
                 
         if not selected:
             messagebox.showinfo("Información", "Por favor seleccione al menos un síntoma para realizar el diagnóstico.")
-            self.results_text.config(state=tk.DISABLED)
             return
         
+        # Run the expert system (only the selections changed since the last run are re-evaluated)
+        result = self.engine.update({category: var.get() for category, var in self.selected_symptoms.items()})
+        self.save_to_history(diagnosis=result)
+        self.show_diagnosis(selected, result)
+    
+    def show_diagnosis(self, selected, result: DiagnosisResult):
+        """Display the selected symptoms and their diagnosis"""
+        # Clear previous results
+        self.results_text.config(state=tk.NORMAL)
+        self.results_text.delete(1.0, tk.END)
+        
         # Add selected symptoms to results
         self.results_text.insert(tk.END, "Síntomas seleccionados:\n")
         for category, symptom in selected:
             self.results_text.insert(tk.END, f"• {category}: {symptom}\n")
-            # Assert the symptom in the CLIPS environment
-            self.env.assert_string(f'(sintoma (categoria "{category}") (caracteristica "{symptom}"))')
         
         self.results_text.insert(tk.END, "\n")
         
-        # Run the expert system
-        self.env.run()
-        
-        # Get diagnoses and treatments
-        deficiencies = {fact['deficiencia'] for fact in self.env.facts() if fact.template.name == 'diagnostico'}
-        treatments = {fact['recomendacion'] for fact in self.env.facts() if fact.template.name == 'tratamiento'}
+        deficiencies = result.deficiencies
+        treatments = result.treatments
         
-        # Display results
+        # Display results, most supported deficiencies first
         if deficiencies:
+            confidence = {entry.deficiency: entry.confidence for entry in self.ranking.rank(selected, k=None)}
             self.results_text.insert(tk.END, "Deficiencias detectadas:\n")
-            for deficiency in deficiencies:
-                self.results_text.insert(tk.END, f"• {deficiency.capitalize()}\n")
+            for deficiency in sorted(deficiencies, key=lambda deficiency: -confidence.get(deficiency, 0)):
+                self.results_text.insert(
+                    tk.END, f"• {deficiency.capitalize()} (confianza {confidence.get(deficiency, 0):.0%})\n")
             
             self.results_text.insert(tk.END, "\nTratamientos recomendados:\n")
             for treatment in treatments:
@@ -578,14 +694,130 @@ class PlantExpertSystemGUI:
         self.results_text.config(state=tk.DISABLED)
         
         # Reset the CLIPS environment
-        self.env.reset()
+        if self._engine is not None:
+            self._engine.clear()
 
 
-def main():
+def run_pipeline(input_path: str = '-', output_path: str = '-', input_format: str = None,
+                 output_format: str = None, batch_size: int = 1000, fuzzy_mode: str = 'exact',
+                 diagnosis_engine: str = 'clips', top_k: int = None, history: str = None):
+    """Process a whole file (or stdin) of field records into a results file (or stdout)
+    
+    With top_k, every result also lists its top_k deficiencies by confidence;
+    with history, results are also saved to that SQLite database.
+    """
+    input_format = input_format or guess_format(input_path)
+    output_format = output_format or guess_format(output_path)
+    with open_records(input_path, output_path) as (source, target):
+        records = read_records(source, input_format)
+        engine = mascaras.BitmaskDiagnosisEngine() if diagnosis_engine == 'bitmask' else DiagnosisEngine()
+        ranking = diferencial.DifferentialDiagnosis() if top_k else None
+        results = process_records(records, batch_size, DiagnosisCache(engine), RecommendationEngine(mode=fuzzy_mode),
+                                  ranking, top_k)
+        store = historial.HistoryStore(history, batch_size=max(batch_size, 1000)) if history else None
+        if store is not None:
+            results = historial.record_history(results, store)
+        write_records(results, target, output_format, flush_every=batch_size)
+        if store is not None:
+            store.close()
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Command line options; without --headless the GUI is launched"""
+    parser = argparse.ArgumentParser(description="Sistema Experto de Diagnóstico de Plantas")
+    parser.add_argument('--headless', action='store_true',
+                        help="procesar registros de campo sin interfaz gráfica")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="archivo CSV/JSONL de entrada ('-' para stdin)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="archivo CSV/JSONL de salida ('-' para stdout)")
+    parser.add_argument('--input-format', choices=('csv', 'jsonl'))
+    parser.add_argument('--output-format', choices=('csv', 'jsonl'))
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="registros procesados y escritos por lote")
+    parser.add_argument('--fuzzy-mode', choices=RecommendationEngine.MODES, default='exact')
+    parser.add_argument('--diagnosis-engine', choices=('clips', 'bitmask'), default='clips',
+                        help="motor de diagnóstico: CLIPS o reglas compiladas a máscaras de bits")
+    parser.add_argument('--top-k', type=int, metavar='K',
+                        help="añadir las K deficiencias más probables, con su confianza y tratamiento")
+    parser.add_argument('--history', metavar='DB',
+                        help="guardar diagnósticos y recomendaciones en esta base SQLite")
+    parser.add_argument('--stream', action='store_true',
+                        help="con --headless, tratar la entrada como lecturas de sensores (parcela, ph, riego) "
+                             "y emitir solo los cambios de recomendación")
+    parser.add_argument('--site', action='store_true',
+                        help="con --headless, tratar la entrada como la tabla de parcelas de un sitio (parcela, ph, "
+                             "riego) y dar la pertenencia de cada planta, las --top-k mejores y estadísticas")
+    parser.add_argument('--site-summary', metavar='FILE',
+                        help="con --site, guardar las estadísticas del sitio en este archivo JSON")
+    parser.add_argument('--report', metavar='DIR',
+                        help="con --headless, dibujar sin pantalla la superficie de decisión, las funciones de "
+                             "pertenencia y un gráfico por muestra (parcela, ph, riego) en este directorio")
+    parser.add_argument('--report-format', choices=informe.REPORT_FORMATS, default='png')
+    parser.add_argument('--workers', type=int, help="procesos para dibujar el informe (por defecto, uno por CPU)")
+    parser.add_argument('--max-tasks-per-child', type=int, metavar='N',
+                        help="reemplazar cada proceso de dibujo tras N lotes de gráficos")
+    parser.add_argument('--ph-tolerance', type=float, default=0.05)
+    parser.add_argument('--riego-tolerance', type=float, default=0.05)
+    parser.add_argument('--value-tolerance', type=float, default=0.05,
+                        help="cambio del valor difuso que se considera material")
+    parser.add_argument('--verify-engines', action='store_true',
+                        help="comparar el motor de máscaras de bits con CLIPS y terminar")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="guardar métricas por fase al terminar (.json, o .prom para Prometheus)")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    if args.verify_engines:
+        mismatches = mascaras.check_bitmask_equivalence()
+        for symptoms, expected, result in mismatches:
+            print(f"Diferencia en {symptoms}: CLIPS {expected[1:]} / bitmask {result[1:]}", file=sys.stderr)
+        print(f"{len(all_symptom_sets())} combinaciones comparadas, {len(mismatches)} diferencias")
+        incremental = check_incremental_equivalence()
+        for selections, expected, result in incremental:
+            print(f"Diferencia incremental en {selections}: CLIPS {expected[1:]} / incremental {result[1:]}",
+                  file=sys.stderr)
+        print(f"{len(incremental)} diferencias en el diagnóstico incremental")
+        sys.exit(1 if mismatches or incremental else 0)
+    
+    if args.headless and args.stream:
+        stream = sensores.SensorStream(args.ph_tolerance, args.riego_tolerance, args.value_tolerance)
+        sensores.run_stream(args.input, args.output, args.input_format, args.batch_size, stream)
+        if args.metrics:
+            METRICS.write(args.metrics)
+        return
+    
+    if args.headless and args.report:
+        counts = informe.run_report(args.input, args.report, args.output, args.input_format, args.report_format,
+                            args.workers, args.max_tasks_per_child)
+        print(f"{counts['graficos']} gráficos en {args.report}, {counts['errores']} muestras con errores",
+              file=sys.stderr)
+        if args.metrics:
+            METRICS.write(args.metrics)
+        return
+    
+    if args.headless and args.site:
+        summary = sitio.run_site(args.input, args.output, args.input_format, args.output_format, args.batch_size,
+                           args.top_k or 3, args.site_summary)
+        if not args.site_summary:
+            print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+        if args.metrics:
+            METRICS.write(args.metrics)
+        return
+    
+    if args.headless:
+        run_pipeline(args.input, args.output, args.input_format, args.output_format,
+                     args.batch_size, args.fuzzy_mode, args.diagnosis_engine, args.top_k, args.history)
+        if args.metrics:
+            METRICS.write(args.metrics)
+        return
+    
     root = tk.Tk()
     app = PlantExpertSystemGUI(root)
     root.mainloop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,213 @@
+"""Plant planning of a whole site from its table of plots
+
+For every plot (parcela, ph, riego), the membership of each plant term of the
+fuzzy output, the best-rated plants and, at the end, site-wide statistics,
+all computed in vectorized batches:
+
+    python sistemaPlantas.py --headless --site parcelas.csv -o plan.csv --top-k 2 --site-summary sitio.json
+"""
+from __future__ import annotations
+
+import json
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+import nucleoPlantas as nucleo
+
+np = nucleo.LazyModule('numpy', 'np', globals())
+
+
+class PlantSuggestion(NamedTuple):
+    """One plant of a plot's ranking, with the activation of its planta term"""
+    plant: str
+    membership: float
+
+
+class SitePlanner:
+    """Membership of every planta term and top-k plants for a whole table of plots
+    
+    One vectorized pass per chunk gives, for each plot, the activation of every
+    output term (the cut levels that compute() collapses into one crisp value)
+    and the crisp value itself, so the plants are ranked by their own degree
+    instead of by PLANT_THRESHOLDS. Terms come from the fuzzy model, so a
+    plant added to PLANTA_SETS and FUZZY_RULES is ranked without changes here.
+    Plots where no rule fires get a NaN value and all-zero memberships.
+    """
+    
+    def __init__(self, model: nucleo.VectorizedFuzzyEngine = None):
+        self.model = model if model is not None else nucleo.shared_fuzzy_model()
+        self.plants = tuple(term.capitalize() for term in self.model.planta_terms)
+    
+    def evaluate(self, ph_values, riego_values, chunk_size: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Crisp values (N,) and term memberships (N, plants) for arrays of inputs"""
+        ph_values = np.ravel(np.asarray(ph_values, dtype=float))
+        riego_values = np.ravel(np.asarray(riego_values, dtype=float))
+        if len(ph_values) != len(riego_values):
+            raise ValueError("pH y riego deben tener la misma longitud.")
+        values = np.full(len(ph_values), np.nan)
+        memberships = np.empty((len(ph_values), len(self.plants)))
+        chunk_size = chunk_size or self.model.chunk_size
+        for start in range(0, len(ph_values), chunk_size):
+            end = start + chunk_size
+            cuts = self.model.activations(ph_values[start:end], riego_values[start:end])
+            memberships[start:end] = cuts
+            fired = cuts.any(axis=1)
+            if fired.any():
+                values[start:end][fired] = self.model.defuzzify(cuts[fired])
+        return values, memberships
+    
+    @staticmethod
+    def top(memberships: np.ndarray, k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """Term indices and memberships of the k best plants of each plot, best first
+        
+        Ties keep the term order of the model.
+        """
+        k = min(k, memberships.shape[1])
+        order = np.argsort(-memberships, axis=1, kind='stable')[:, :k]
+        return order, np.take_along_axis(memberships, order, axis=1)
+    
+    def suggestions(self, memberships: np.ndarray, k: int = 3) -> List[List[PlantSuggestion]]:
+        """Top-k plants of each plot, leaving out plants with no support"""
+        order, degrees = self.top(memberships, k)
+        plants = self.plants
+        return [[PlantSuggestion(plants[term], degree) for term, degree in zip(terms, row) if degree > 0]
+                for terms, row in zip(order.tolist(), degrees.tolist())]
+    
+    def rank(self, ph_value: float, riego_value: float, k: int = 3) -> List[PlantSuggestion]:
+        """Top-k plants of a single plot"""
+        nucleo.validate_inputs(ph_value, riego_value)
+        _, memberships = self.evaluate([ph_value], [riego_value])
+        return self.suggestions(memberships, k)[0]
+
+
+class SiteStatistics:
+    """Aggregate figures of a site, accumulated batch by batch from SitePlanner results
+    
+    For each plant: plots where it ranks first, plots where its membership
+    reaches suitable, and its mean membership; plus the range and mean of the
+    crisp values, the plots where no rule fired and the rows left out because
+    their inputs were missing or out of range.
+    """
+    
+    def __init__(self, plants: Tuple[str, ...], suitable: float = 0.5):
+        self.plants = plants
+        self.suitable = suitable
+        self.plots = 0
+        self.unmatched = 0
+        self.invalid = 0
+        self.best = np.zeros(len(plants), dtype=np.int64)
+        self.suitable_plots = np.zeros(len(plants), dtype=np.int64)
+        self.membership_sum = np.zeros(len(plants))
+        self.value_sum = 0.0
+        self.value_min = np.inf
+        self.value_max = -np.inf
+    
+    def add(self, values: np.ndarray, memberships: np.ndarray):
+        """Include a batch of plots"""
+        fired = memberships.any(axis=1)
+        self.plots += len(values)
+        self.unmatched += int(len(values) - np.count_nonzero(fired))
+        self.best += np.bincount(np.argmax(memberships[fired], axis=1), minlength=len(self.plants))
+        self.suitable_plots += np.count_nonzero(memberships >= self.suitable, axis=0)
+        self.membership_sum += memberships.sum(axis=0)
+        if fired.any():
+            matched = values[fired]
+            self.value_sum += float(matched.sum())
+            self.value_min = min(self.value_min, float(matched.min()))
+            self.value_max = max(self.value_max, float(matched.max()))
+    
+    def summary(self) -> Dict:
+        """JSON-ready statistics of the plots added so far"""
+        matched = self.plots - self.unmatched
+        plots = max(self.plots, 1)
+        return {
+            'parcelas': self.plots,
+            'sin_regla': self.unmatched,
+            'invalidas': self.invalid,
+            'valor': {
+                'media': self.value_sum / matched if matched else None,
+                'min': self.value_min if matched else None,
+                'max': self.value_max if matched else None
+            },
+            'plantas': {
+                plant: {
+                    'mejor': int(self.best[term]),
+                    'proporcion_mejor': int(self.best[term]) / plots,
+                    'aptas': int(self.suitable_plots[term]),
+                    'pertenencia_media': float(self.membership_sum[term]) / plots
+                }
+                for term, plant in enumerate(self.plants)
+            }
+        }
+
+
+def plan_site(records: Iterable[Dict], planner: SitePlanner = None, statistics: SiteStatistics = None,
+              batch_size: int = 100000, top_k: int = 3) -> Iterator[Dict]:
+    """Plan of every plot of a stream of site records (parcela, ph, riego), batch by batch
+    
+    Each result keeps the input fields and adds the crisp valor, the
+    membership of every plant, and the top_k plants with their degree; each
+    batch is evaluated in one vectorized call and added to statistics.
+    Missing or invalid inputs leave those fields empty, with the reason in
+    'error'.
+    """
+    planner = planner if planner is not None else SitePlanner()
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        results, valid, ph_values, riego_values = [], [], [], []
+        for record in batch:
+            result = dict(record)
+            result['valor'] = None
+            result.update(dict.fromkeys(planner.plants))
+            result['sugerencias'] = []
+            try:
+                ph_value, riego_value = nucleo.parse_inputs(record.get(nucleo.RECORD_PH),
+                                                            record.get(nucleo.RECORD_RIEGO))
+                valid.append(len(results))
+                ph_values.append(ph_value)
+                riego_values.append(riego_value)
+            except (TypeError, ValueError) as e:
+                result['error'] = str(e)
+            results.append(result)
+        
+        start = time.perf_counter()
+        values, memberships = planner.evaluate(ph_values, riego_values)
+        if statistics is not None:
+            statistics.add(values, memberships)
+            statistics.invalid += len(batch) - len(valid)
+        memberships = memberships.round(6)
+        suggestions = planner.suggestions(memberships, top_k)
+        nucleo.METRICS.observe('site_batch', time.perf_counter() - start)
+        for index, value, degrees, ranked in zip(valid, values.tolist(), memberships.tolist(), suggestions):
+            result = results[index]
+            result['valor'] = None if value != value else round(value, 6)
+            result.update(zip(planner.plants, degrees))
+            result['sugerencias'] = [entry._asdict() for entry in ranked]
+        yield from results
+
+
+def run_site(input_path: str = '-', output_path: str = '-', input_format: str = None, output_format: str = None,
+             batch_size: int = 100000, top_k: int = 3, summary_path: str = None,
+             planner: SitePlanner = None) -> Dict:
+    """Plan every plot of a site table (see plan_site) into a results file and summarize the site
+    
+    The site statistics are returned and, with summary_path, written there
+    as JSON.
+    """
+    planner = planner if planner is not None else SitePlanner()
+    statistics = SiteStatistics(planner.plants)
+    input_format = input_format or nucleo.guess_format(input_path)
+    output_format = output_format or nucleo.guess_format(output_path)
+    with nucleo.open_records(input_path, output_path) as (source, target):
+        results = plan_site(nucleo.read_records(source, input_format), planner, statistics, batch_size, top_k)
+        nucleo.write_records(results, target, output_format, flush_every=batch_size)
+    
+    summary = statistics.summary()
+    if summary_path:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary